@@ -12,13 +12,14 @@ class QuantumOpticalExperiment:
     Allows for controlling the laser, time-taggers, and power meter within a single class.
     """
 
-    def __init__(self, verbose=True, simulation=False):
+    def __init__(self, verbose=True, simulation=False, replay=None):
         #from tqt.control.timetagger_uqd import TimeTagger
         #from tqt.control.laser_toptica import TOpticaLaser
         #from tqt.control.powermeter_thorlabs import PowerMeter
         
         self.verbose = verbose
         self.simulation = simulation
+        self.replay = replay  # tag file (in IO.default_path) replayed by the time tagger instead of measuring
         self.config_filepath = pathlib.Path(__file__).parent.joinpath("config.yaml")
         self.config, self.yaml = self.load_config()
 
@@ -47,7 +48,7 @@ class QuantumOpticalExperiment:
             visa_address=self.config["POWERMETER_PORT"]
         )
 
-        if self.simulation:
+        if self.simulation or self.replay is not None:
             # Check if the virtual power meter has the 'attach_laser' method
             if hasattr(self.powermeter, 'attach_laser'):
                 print(f"[SIM] Linking Power Meter to Laser...")
@@ -60,9 +61,16 @@ class QuantumOpticalExperiment:
         """
         If self.simulation is True, load the simulation driver.
         If self.simulation is False, TRY to load the real driver. If it fails, load the simulation driver.
+        If self.replay is a tag file, the time tagger is the replay driver reading it, whatever the mode, and the
+        other instruments are simulated.
         """
 
-        if self.simulation:
+        if self.replay is not None and module_base == "timetagger_uqd":
+            if self.verbose:
+                print(f"[Mode: REPLAY] Loading {class_name} replaying {self.replay}...")
+            return self._import_driver("simulator", module_base + "_replay", class_name, self.replay, *args, **kwargs)
+
+        if self.simulation or self.replay is not None:
             module_base = module_base + "_sim"
             if self.verbose:
                 print(f"[Mode: SIM] Loading virtual {class_name}...")
@@ -1,5 +1,6 @@
 from time import sleep
 import sys
+import argparse
 import numpy as np
 import pathlib
 import matplotlib.pyplot as plt
@@ -31,7 +32,12 @@ from tqt.widgets.plot_counts import PlotLogicGrid
 from experiment import QuantumOpticalExperiment
 
 
-system = QuantumOpticalExperiment(simulation=True)
+# --replay FILE runs the whole interface on a recorded tag file in the data folder instead of the time tagger
+parser = argparse.ArgumentParser(description="Lab interface")
+parser.add_argument("--replay", default=None, help="tag file (.ttbin, .ttarc or .txt) to replay")
+args, qt_args = parser.parse_known_args()
+
+system = QuantumOpticalExperiment(simulation=True, replay=args.replay)
 
 # settings for the interface (color scheme, sizes, refresh rate, font size, etc.)
 ui_config = dict(
@@ -360,8 +366,7 @@ class PhotonStatisticsMonitor(MeasurementBase):
     def update_view(self):
         # Specific logic for updating plots
         if hasattr(self.plot, 'plots'):
-            for plot_widget in self.plot.plots:
-                plot_widget.onNewData()
+            self.plot.update_grid()
 
 
 class CountView(MeasurementBase):
@@ -534,19 +539,31 @@ class CountView(MeasurementBase):
         self.setLayout(main_layout)
 
     def update_view(self):
+        # Read every pattern shown on this tab from the same snapshot in one call
+        patterns = set(self.single_value_labels) | set(self.coinc_value_labels)
+        for pos_chans, neg_chans in self.exp_single_widgets:
+            patterns.update((tuple(pos_chans), tuple(neg_chans)))
+        for groups in self.exp_couples_map.values():
+            patterns.update(tuple(chans) for chans in groups["plus"] + groups["minus"])
+        patterns = list(patterns)
+
+        if hasattr(system.timetagger, "get_count_data_many"):
+            _, counts, _ = system.timetagger.get_count_data_many([list(p) for p in patterns])
+        else:
+            counts = [system.timetagger.get_count_data(list(p))[1] for p in patterns]
+        count_of = {p: int(c) for p, c in zip(patterns, counts)}
+
         # Update Singles
         for channels, label_widget in self.single_value_labels.items():
-            _, count, _ = system.timetagger.get_count_data(list(channels))
-            label_widget.setText(f"{count:,}")
+            label_widget.setText(f"{count_of[tuple(channels)]:,}")
 
         # Update Coincidences
         for channels, label_widget in self.coinc_value_labels.items():
-            _, count, _ = system.timetagger.get_count_data(list(channels))
-            label_widget.setText(f"{count:,}")
+            label_widget.setText(f"{count_of[tuple(channels)]:,}")
         
         for (pos_chans, neg_chans), label_widget in self.exp_single_widgets.items():
-            _, count_pos, _ = system.timetagger.get_count_data(list(pos_chans))
-            _, count_neg, _ = system.timetagger.get_count_data(list(neg_chans))
+            count_pos = count_of[tuple(pos_chans)]
+            count_neg = count_of[tuple(neg_chans)]
             total = count_pos + count_neg
             if total > 0:
                 expectation_val = (count_pos - count_neg) / total
@@ -556,14 +573,8 @@ class CountView(MeasurementBase):
 
         for name, label_widget in self.exp_couples_widgets.items():
             groups = self.exp_couples_map[name]
-            n_plus = 0
-            for chans in groups["plus"]:
-                _, c, _ = system.timetagger.get_count_data(list(chans))
-                n_plus += c
-            n_minus = 0
-            for chans in groups["minus"]:
-                _, c, _ = system.timetagger.get_count_data(list(chans))
-                n_minus += c
+            n_plus = sum(count_of[tuple(chans)] for chans in groups["plus"])
+            n_minus = sum(count_of[tuple(chans)] for chans in groups["minus"])
 
             total = n_plus + n_minus
             
@@ -995,11 +1006,17 @@ class RunMeasurementCrossCorrelationHistogram(QFrame):
     def run_measurement(self):
         system.timetagger.switch_logic()
         filename = "time-tags"
+        # the simulator and replay drivers capture to the binary .ttbin format, other drivers export text
+        binary = type(system.timetagger).__module__.startswith("tqt.simulator.")
+        # never record over the capture being replayed
+        replayed = getattr(system.timetagger, "source_path", None)
+        if replayed is not None and system.io.timetag_file_path(filename, not binary).resolve() == replayed:
+            filename = "time-tags-replayed"
         system.timetagger.save_tags(
-            io=system.io, filename=filename, time=self.meas_time.value(), convert=True
+            io=system.io, filename=filename, time=self.meas_time.value(), convert=not binary
         )
         system.timetagger.switch_logic()
-        tags = system.io.load_timetags(filename=filename + ".txt")
+        tags = system.io.open_timetags(filename=filename + (".ttbin" if binary else ".txt"))
 
         hist, hist_x, hist_norm = cross_correlation_histogram(
             tags=tags,
@@ -1240,7 +1257,7 @@ if __name__ == "__main__":
     if hasattr(QtCore.Qt, 'AA_UseHighDpiPixmaps'):
         QApplication.setAttribute(QtCore.Qt.AA_UseHighDpiPixmaps, True)
 
-    app = QApplication(sys.argv)
+    app = QApplication(sys.argv[:1] + qt_args)
 
     app.setStyle("Fusion")
     app.setPalette(palette)
@@ -0,0 +1,137 @@
+"""
+Coincidence counting functions for analyzing time tag files
+
+Includes:
+    1) Coincidence window sweeps
+        Coincidence and accidental counts of channel pairs for a whole array of window widths (and delay offsets),
+        read off the distribution of the pair time differences, e.g. to choose COINCIDENCE_WINDOW_NS without
+        re-acquiring data for every window
+    2) Software coincidence logic
+        Singles and N-fold coincidence counts of recorded tags, with any coincidence window and channel delays, in
+        the format of the time tagger's get_count_data
+"""
+
+import numpy as np
+
+from tqt.analysis.histogram import BIN_RESOLUTION_NS, _window_pairs
+from tqt.utils.io import TagDataset, tag_columns
+
+
+def coincidence_window_sweep(tags=None, pairs=((1, 2),), windows=np.linspace(0.5, 10, 20), offsets=0.0):
+    """
+    Counts the coincidences of channel pairs for every coincidence window width and delay offset in one pass.
+
+    A pair of tags (a on ch_a, b on ch_b) is a coincidence for window w and offset d if |t_b - t_a - d| <= w / 2.
+    The time differences of all pairs within the widest window are gathered once; for each offset they are sorted
+    by |t_b - t_a - d|, and the coincidences of every window are read off this cumulative distribution.
+
+    Parameters
+    ----------
+    tags: time tags (TAG_DTYPE or (N, 2) array, or a TagDataset)
+    pairs: list of (ch_a, ch_b) channel pairs
+    windows: array of coincidence window widths [ns] (full width, as the time tagger's window_width)
+    offsets: delay offset, or array of offsets [ns], of ch_b relative to ch_a
+
+    Returns
+    -------
+    sweep: dictionary with
+        "windows": (W,) window widths [ns]
+        "offsets": (O,) delay offsets [ns]
+        "coincidences": (P, O, W) coincidence counts
+        "accidentals": (P, W) expected accidental coincidences, Na * Nb * window / T
+        "car": (P, O, W) coincidence-to-accidental ratio
+    """
+    windows = np.atleast_1d(np.asarray(windows, dtype=float))
+    offsets = np.atleast_1d(np.asarray(offsets, dtype=float))
+    pairs = [tuple(pair) for pair in pairs]
+
+    channel_times, T = _channel_times(tags, {ch for pair in pairs for ch in pair})
+    reach = (np.max(np.abs(offsets)) + np.max(windows) / 2) / BIN_RESOLUTION_NS + 1  # [tagger bins]
+
+    coincidences = np.zeros((len(pairs), offsets.shape[0], windows.shape[0]))
+    accidentals = np.zeros((len(pairs), windows.shape[0]))
+    for p, (ch_a, ch_b) in enumerate(pairs):
+        a = channel_times[ch_a]
+        b = channel_times[ch_b]
+        accidentals[p] = a.shape[0] * b.shape[0] * windows / T
+
+        lo = np.searchsorted(b, a - reach, side="left")
+        hi = np.searchsorted(b, a + reach, side="right")
+        dt = [(b[b_ind] - a[a_ind]) * BIN_RESOLUTION_NS for a_ind, b_ind in _window_pairs(lo, hi)]
+        dt = np.concatenate(dt) if dt else np.zeros(0)  # [ns]
+        for o, offset in enumerate(offsets):
+            distance = np.sort(np.abs(dt - offset))
+            coincidences[p, o] = np.searchsorted(distance, windows / 2, side="right")
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        car = coincidences / accidentals[:, None, :]
+    return dict(
+        windows=windows,
+        offsets=offsets,
+        coincidences=coincidences,
+        accidentals=accidentals,
+        car=car,
+    )
+
+
+def count_coincidences(tags=None, patterns=([1], [2], [1, 2]), window_width=3.0, delays=None, duration_s=None):
+    """
+    Software coincidence logic: counts the singles and N-fold coincidences of recorded tags, so captures can be
+    re-analyzed offline with other windows and delays.
+
+    A tag on the first channel of a pattern is counted when every other channel of the pattern has a tag within
+    +-window_width / 2 of it (after the channel delays). Single-channel patterns count the channel's tags, and the
+    empty pattern counts all tags, as the simulator's total count.
+    The windows of all reference tags are found at once with np.searchsorted, one channel at a time.
+
+    Parameters
+    ----------
+    tags: time tags (TAG_DTYPE or (N, 2) array, memory-mapped file, or a TagDataset)
+    patterns: list of channel patterns, as for TimeTagger.get_count_data (e.g. [1], [1, 2], [1, 3, 5])
+    window_width: coincidence window [ns] (full width)
+    delays: delays [ns] added to the tags of channels 1, 2, ..., as the time tagger's channel delays
+        (None: no delays)
+    duration_s: capture duration [s] for the rates. Defaults to the TagDataset duration, or the latest tag time
+
+    Returns
+    -------
+    (durations, counts, rates) arrays with one entry per pattern, as TimeTagger.get_count_data_many
+    """
+    patterns = [list(np.atleast_1d(pattern)) for pattern in patterns]
+    channel_times, T = _channel_times(tags, {ch for pattern in patterns for ch in pattern})
+    if duration_s is None:
+        duration_s = T * 1e-9
+
+    # tag times [ns] with the channel delays
+    times_ns = {}
+    for ch, times in channel_times.items():
+        delay = delays[ch - 1] if delays is not None and 1 <= ch <= len(delays) else 0.0
+        times_ns[ch] = times * BIN_RESOLUTION_NS + delay
+
+    half_window = window_width / 2
+    counts = np.zeros(len(patterns), dtype=np.int64)
+    for i, pattern in enumerate(patterns):
+        if not pattern:
+            counts[i] = len(tag_columns(tags)[1])
+            continue
+        reference = times_ns[pattern[0]]
+        coincident = np.ones(reference.shape[0], dtype=bool)
+        for ch in dict.fromkeys(pattern[1:]):
+            other = times_ns[ch]
+            lo = np.searchsorted(other, reference - half_window, side="left")
+            hi = np.searchsorted(other, reference + half_window, side="right")
+            coincident &= hi > lo
+        counts[i] = np.count_nonzero(coincident)
+
+    durations = np.full(len(patterns), float(duration_s))
+    rates = counts / duration_s if duration_s > 0 else np.zeros(len(patterns))
+    return durations, counts, rates
+
+
+def _channel_times(tags, channels):
+    """Returns the times [tagger bins] of the tags of each channel, and the total measurement time [ns]."""
+    if isinstance(tags, TagDataset):
+        return {ch: tags.channel(ch) for ch in channels}, tags.duration_s * 1e9
+    tag_channels, times = tag_columns(tags)
+    T = np.max(times) * BIN_RESOLUTION_NS  # total measurement time [ns]
+    return {ch: times[tag_channels == ch] for ch in channels}, T
@@ -9,16 +9,26 @@ Includes:
         pseudo-thermal sources, where the histogram width is into the micro/millisecond regime
 """
 
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
 import matplotlib.pyplot as plt
 from math import floor, ceil
 from tqdm import tqdm
 
-from tqt.utils.io import IO
+from tqt.utils.io import IO, TagDataset, tag_columns
+
+
+BIN_RESOLUTION_NS = 0.15625  # time tagger bin [ns]
+MAX_PAIRS_PER_BLOCK = 1 << 22  # bounds the memory of the vectorized engine
+FFT_OVERSAMPLE = 4  # time grid cells per histogram bin for the FFT engine
+FFT_AUTO_OVERSAMPLE = 16  # finer grid when engine="auto" picks the FFT engine
 
 
 def cross_correlation_histogram(
-    tags=None, ch_a=1, ch_b=2, bin_width=100, hist_width=50000
+    tags=None, ch_a=1, ch_b=2, bin_width=100, hist_width=50000, engine="vectorized", max_workers=1
 ):
     """
     Calculates a cross-correlation histogram between two time-tagger channels.
@@ -26,11 +36,27 @@ def cross_correlation_histogram(
 
     Parameters
     ----------
-    tags: numpy array imported from a time-tage text file
+    tags: numpy array imported from a time-tag file (text or binary, see IO.load_timetags), or a TagDataset
+        (see IO.open_timetags), whose cached per-channel arrays are then used
     ch_a: channel integer value to use as Channel A (must be an integer between 1 and 16, inclusive)
     ch_b: integer value to use as Channel B (must be an integer between 1 and 16, inclusive)
     bin_width: width of each individual bin in the histogram [ns]
     hist_width: the histogram ranges from -hist_widtht to +hist_width [ns]
+    engine: "vectorized" (default) finds the window of every A tag in B with np.searchsorted and histograms blocks
+        of pairs with np.bincount; "loop" is the original pure-Python implementation, with identical results.
+        "fft" bins both channels onto a common time grid (FFT_OVERSAMPLE cells per bin) and correlates them with
+        numpy.fft, segment by segment, which suits wide (micro/millisecond) histograms of long captures. Its time
+        delays are only resolved to one grid cell, so pairs near a bin edge can land in the neighbouring bin: about
+        1 / (3 * oversample) of all pairs, i.e. 8% at FFT_OVERSAMPLE. On flat parts of the histogram these moves
+        largely cancel out, but features narrower than a bin are blurred into the neighbouring bins.
+        "integer" is the pairwise engine in int64 tagger bins, exact (no float rounding at the bin edges) and
+        faster; bin_width and hist_width must then be multiples of BIN_RESOLUTION_NS.
+        "auto" picks "fft" when the expected number of pairs exceeds the number of grid cells, with the finer grid
+        of FFT_AUTO_OVERSAMPLE cells per bin (about 2% of the pairs moved), and "vectorized" otherwise. It is not
+        the default, so that default results stay exact; pass it explicitly to accept the FFT approximation
+    max_workers: number of threads for the "vectorized", "integer" and "fft" engines (None: one per CPU). The A tags are split
+        into time blocks, each correlated with the B tags of its span plus hist_width margins, and the partial
+        histograms summed. Each pair belongs to exactly one block, so the "vectorized" result is unchanged
 
     Returns
     -------
@@ -39,15 +65,207 @@ def cross_correlation_histogram(
     hist_norm: (normalized) histogram count frequencies (see Kevin's notes on how to normalize using single counts)
     """
 
-    a = tags[(tags[:, 0] == ch_a), 1]
-    b = tags[(tags[:, 0] == ch_b), 1]
-    T = np.max(tags[:, 1]) * 0.15625  # total measurement time [ns]
+    if isinstance(tags, TagDataset):
+        a = tags.channel(ch_a)
+        b = tags.channel(ch_b)
+        T = tags.duration_s * 1e9  # total measurement time [ns]
+    else:
+        channels, times = tag_columns(tags)
+        a = times[channels == ch_a]
+        b = times[channels == ch_b]
+        T = np.max(times) * BIN_RESOLUTION_NS  # total measurement time [ns]
 
     n_bins = ceil(2 * hist_width / bin_width)
 
-    hist = np.zeros(n_bins)
     hist_bins = np.linspace(-hist_width, hist_width, n_bins)
 
+    oversample = FFT_OVERSAMPLE
+    if engine == "auto":
+        expected_pairs = a.shape[0] * b.shape[0] * 2 * hist_width / T
+        grid_cells = T * FFT_AUTO_OVERSAMPLE / bin_width
+        engine = "fft" if expected_pairs > grid_cells else "vectorized"
+        oversample = FFT_AUTO_OVERSAMPLE
+
+    if engine in ("vectorized", "integer", "fft"):
+        histogram = _histogram_vectorized
+        if engine == "integer":
+            histogram = _histogram_integer
+            a = a.astype(np.int64, copy=False)
+            b = b.astype(np.int64, copy=False)
+        elif engine == "fft" and a.shape[0] and b.shape[0]:
+            # the same grid for every time block
+            histogram = functools.partial(_histogram_fft, t0=min(a[0], b[0]), oversample=oversample)
+        elif engine == "fft":
+            histogram = _histogram_fft
+        if max_workers == 1:
+            hist = histogram(a, b, bin_width, hist_width, n_bins)
+        else:
+            hist = _histogram_parallel(histogram, a, b, bin_width, hist_width, n_bins, max_workers)
+    elif engine == "loop":
+        hist = _histogram_loop(a, b, bin_width, hist_width, n_bins)
+    else:
+        raise ValueError(f"Unknown histogram engine {engine}")
+
+    accidentals = (bin_width / T) * (a.shape[0] * b.shape[0])
+    hist_norm = hist / accidentals
+    return hist, hist_bins, hist_norm
+
+
+def correlation_matrix(tags=None, channels=range(1, 17), bin_width=100, hist_width=50000):
+    """
+    Calculates the cross-correlation histograms between all pairs of the given channels in a single pass over the
+    time-sorted tags, e.g. to align the delays of all channels at once.
+
+    Every tag is paired with the later tags within hist_width of it, and each pair fills both its (A, B) and mirrored
+    (B, A) histograms. Entry [i, j] matches cross_correlation_histogram(tags, channels[i], channels[j], ...), except
+    that diagonal histograms do not pair a tag with itself.
+
+    Parameters
+    ----------
+    tags: time tags (see cross_correlation_histogram)
+    channels: the C channels to correlate
+    bin_width: width of each individual bin in the histogram [ns]
+    hist_width: the histograms range from -hist_width to +hist_width [ns]
+
+    Returns
+    -------
+    hist: (C, C, n_bins) histogram counts, hist[i, j] counting channel-j tags at each delay from channel-i tags
+    hist_bins: the central value of each bin
+    hist_norm: (C, C, n_bins) histograms normalized by their accidental counts
+    """
+    channels = list(channels)
+    n_channels = len(channels)
+    tag_channels, times = tag_columns(tags)
+    if isinstance(tags, TagDataset):
+        T = tags.duration_s * 1e9  # total measurement time [ns]
+    else:
+        T = np.max(times) * BIN_RESOLUTION_NS  # total measurement time [ns]
+
+    # one mask for all channels, then each tag's row in the matrix
+    lookup = np.full(int(max(channels)) + 1, -1, dtype=np.int64)
+    lookup[channels] = np.arange(n_channels)
+    ch = np.asarray(tag_channels).astype(np.int64)
+    selected = (ch >= 0) & (ch < lookup.shape[0])
+    selected[selected] = lookup[ch[selected]] >= 0
+    rows = lookup[ch[selected]]
+    times = times[selected]
+
+    n_bins = ceil(2 * hist_width / bin_width)
+    hist_bins = np.linspace(-hist_width, hist_width, n_bins)
+
+    ind = np.arange(times.shape[0])
+    hi = np.searchsorted(times, times + hist_width / BIN_RESOLUTION_NS + 1, side="right")
+    flat = np.zeros(n_channels * n_channels * n_bins)
+    for i, j in _window_pairs(ind + 1, np.maximum(hi, ind + 1)):
+        dt = (times[j] - times[i]) * BIN_RESOLUTION_NS  # [ns]
+        keep = dt <= hist_width
+        i, j, dt = i[keep], j[keep], dt[keep]
+        for sign, row, col in ((1, rows[i], rows[j]), (-1, rows[j], rows[i])):
+            bin_ind = np.floor((sign * dt + hist_width) / bin_width).astype(np.int64)
+            keep = bin_ind < n_bins
+            flat += np.bincount(
+                (row[keep] * n_channels + col[keep]) * n_bins + bin_ind[keep], minlength=flat.shape[0]
+            )
+    hist = flat.reshape(n_channels, n_channels, n_bins)
+
+    singles = np.bincount(rows, minlength=n_channels)
+    accidentals = (bin_width / T) * np.outer(singles, singles)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        hist_norm = hist / accidentals[:, :, None]
+    return hist, hist_bins, hist_norm
+
+
+class CorrelationAccumulator:
+    """
+    Running cross-correlation histogram between two channels, updated chunk by chunk, for long or live captures.
+
+    Chunks must follow each other in time (e.g. TimeTagger.iter_tags, TagDataset.iter_chunks). The A and B tags of
+    the last hist_width of the stream are kept to pair with the next chunk, so pairs across chunk boundaries are
+    counted exactly once and the result is identical to cross_correlation_histogram on the whole capture, while
+    memory stays bounded by the chunk size.
+
+    Typical usage:
+        acc = CorrelationAccumulator(ch_a=1, ch_b=2, bin_width=0.5, hist_width=50)
+        for chunk in timetagger.iter_tags(time=60.0, chunk_s=1.0):
+            acc.add(chunk)
+        hist, hist_bins, hist_norm = acc.result()
+    """
+
+    def __init__(self, ch_a=1, ch_b=2, bin_width=100, hist_width=50000):
+        self.ch_a = ch_a
+        self.ch_b = ch_b
+        self.bin_width = bin_width
+        self.hist_width = hist_width
+
+        self.n_bins = ceil(2 * hist_width / bin_width)
+        self.hist_bins = np.linspace(-hist_width, hist_width, self.n_bins)
+        self.reset()
+
+    def reset(self):
+        self.hist = np.zeros(self.n_bins)
+        self.singles_a = 0
+        self.singles_b = 0
+        self.duration_s = None  # sum of the chunk durations, if known
+        self.last_time = None  # latest tag time seen [tagger bins]
+        self._tail_a = np.zeros(0)
+        self._tail_b = np.zeros(0)
+
+    def add(self, tags, duration_s=None):
+        """
+        Adds a chunk of tags (TAG_DTYPE or (N, 2) array, or a TagDataset) to the histogram.
+        duration_s: the chunk's capture time [s], used for hist_norm. Taken from TagDataset chunks; if never
+            given, the measurement time is the latest tag time, as in cross_correlation_histogram.
+        """
+        if isinstance(tags, TagDataset):
+            a = tags.channel(self.ch_a)
+            b = tags.channel(self.ch_b)
+            duration_s = tags.duration_s if duration_s is None else duration_s
+            times = tags.times
+        else:
+            channels, times = tag_columns(tags)
+            a = times[channels == self.ch_a]
+            b = times[channels == self.ch_b]
+
+        # pairs with at least one new tag: new A with old and new B, then old A with new B
+        self.hist += _histogram_vectorized(
+            a, np.concatenate([self._tail_b, b]), self.bin_width, self.hist_width, self.n_bins
+        )
+        self.hist += _histogram_vectorized(self._tail_a, b, self.bin_width, self.hist_width, self.n_bins)
+
+        self.singles_a += a.shape[0]
+        self.singles_b += b.shape[0]
+        if duration_s is not None:
+            self.duration_s = (self.duration_s or 0.0) + duration_s
+        if times.shape[0]:
+            last_time = np.max(times)
+            self.last_time = last_time if self.last_time is None else max(self.last_time, last_time)
+
+        # keep the tags the next chunk can still pair with
+        if self.last_time is not None:
+            cut = self.last_time - self.hist_width / BIN_RESOLUTION_NS - 1
+            tail_a = np.concatenate([self._tail_a, a])
+            tail_b = np.concatenate([self._tail_b, b])
+            self._tail_a = tail_a[tail_a >= cut]
+            self._tail_b = tail_b[tail_b >= cut]
+        return self
+
+    @property
+    def hist_norm(self):
+        if self.duration_s is not None:
+            T = self.duration_s * 1e9  # total measurement time [ns]
+        else:
+            T = self.last_time * BIN_RESOLUTION_NS
+        accidentals = (self.bin_width / T) * (self.singles_a * self.singles_b)
+        return self.hist / accidentals
+
+    def result(self):
+        """Returns (hist, hist_bins, hist_norm), as cross_correlation_histogram."""
+        return self.hist.copy(), self.hist_bins, self.hist_norm
+
+
+def _histogram_loop(a, b, bin_width, hist_width, n_bins):
+    hist = np.zeros(n_bins)
+
     start_ind = 0
 
     j = 0
@@ -55,7 +273,7 @@ def cross_correlation_histogram(
         a_t = a[i]
         while j < b.shape[0]:
             b_t = b[j]
-            dt = (b_t - a_t) * 0.15625  # [ns]
+            dt = (b_t - a_t) * BIN_RESOLUTION_NS  # [ns]
             if dt < -hist_width:
                 start_ind = j
             elif dt > hist_width:
@@ -73,9 +291,131 @@ def cross_correlation_histogram(
         j = start_ind
         i += 1
 
-    accidentals = (bin_width / T) * (a.shape[0] * b.shape[0])
-    hist_norm = hist / accidentals
-    return hist, hist_bins, hist_norm
+    return hist
+
+
+def _histogram_vectorized(a, b, bin_width, hist_width, n_bins):
+    hist = np.zeros(n_bins)
+    if a.shape[0] == 0 or b.shape[0] == 0:
+        return hist
+
+    # window of B tags around each A tag, in tagger bins (widened by one bin, the exact float cut is done below)
+    half_width = hist_width / BIN_RESOLUTION_NS
+    lo = np.searchsorted(b, a - half_width - 1, side="left")
+    hi = np.searchsorted(b, a + half_width + 1, side="right")
+
+    for a_ind, b_ind in _window_pairs(lo, hi):
+        dt = (b[b_ind] - a[a_ind]) * BIN_RESOLUTION_NS  # [ns]
+        dt = dt[(dt >= -hist_width) & (dt <= hist_width)]
+        bin_ind = np.floor((dt + hist_width) / bin_width).astype(np.int64)
+        hist += np.bincount(bin_ind[bin_ind < n_bins], minlength=n_bins)
+
+    return hist
+
+
+def _histogram_integer(a, b, bin_width, hist_width, n_bins):
+    hist = np.zeros(n_bins)
+    bin_width = _tagger_bins(bin_width, "bin_width")
+    hist_width = _tagger_bins(hist_width, "hist_width")
+    if a.shape[0] == 0 or b.shape[0] == 0:
+        return hist
+
+    lo = np.searchsorted(b, a - hist_width, side="left")
+    hi = np.searchsorted(b, a + hist_width, side="right")
+    for a_ind, b_ind in _window_pairs(lo, hi):
+        bin_ind = (b[b_ind] - a[a_ind] + hist_width) // bin_width
+        hist += np.bincount(bin_ind[bin_ind < n_bins], minlength=n_bins)
+    return hist
+
+
+def _tagger_bins(value_ns, name):
+    """Converts a width [ns] into a whole number of tagger bins."""
+    n = round(value_ns / BIN_RESOLUTION_NS)
+    if n <= 0 or abs(n * BIN_RESOLUTION_NS - value_ns) > 1e-9 * abs(value_ns):
+        raise ValueError(
+            f"{name} = {value_ns} ns is not a multiple of the time tagger resolution ({BIN_RESOLUTION_NS} ns)"
+        )
+    return n
+
+
+def _histogram_parallel(histogram, a, b, bin_width, hist_width, n_bins, max_workers=None):
+    max_workers = max_workers or os.cpu_count() or 1
+    # [tagger bins], with a histogram bin of margin for the time grid of the FFT engine
+    half_width = (hist_width + bin_width) / BIN_RESOLUTION_NS + 1
+
+    def block_histogram(block):
+        a_block = a[block[0] : block[1]]
+        b_lo = np.searchsorted(b, a_block[0] - half_width, side="left")
+        b_hi = np.searchsorted(b, a_block[-1] + half_width, side="right")
+        return histogram(a_block, b[b_lo:b_hi], bin_width, hist_width, n_bins)
+
+    # a few blocks per worker balances uneven tag rates
+    edges = np.linspace(0, a.shape[0], min(4 * max_workers, a.shape[0]) + 1).astype(np.int64)
+    blocks = [(lo, hi) for lo, hi in zip(edges[:-1], edges[1:]) if hi > lo]
+    hist = np.zeros(n_bins)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for block_hist in executor.map(block_histogram, blocks):
+            hist += block_hist
+    return hist
+
+
+def _window_pairs(lo, hi):
+    """
+    Yields the (a_ind, b_ind) index pairs of every A tag i with the B tags lo[i] <= j < hi[i], in blocks of
+    consecutive A tags with at most MAX_PAIRS_PER_BLOCK pairs (but at least one tag).
+    """
+    n_pairs = hi - lo
+    if n_pairs.shape[0] == 0:
+        return
+    cum_pairs = np.cumsum(n_pairs)
+    edges = np.searchsorted(cum_pairs, np.arange(MAX_PAIRS_PER_BLOCK, cum_pairs[-1], MAX_PAIRS_PER_BLOCK))
+    edges = np.unique(np.concatenate([[0], edges + 1, [lo.shape[0]]]).clip(0, lo.shape[0]))
+
+    for start, stop in zip(edges[:-1], edges[1:]):
+        counts = n_pairs[start:stop]
+        total = counts.sum()
+        if total == 0:
+            continue
+        first = np.cumsum(counts) - counts
+        b_ind = np.arange(total) - np.repeat(first - lo[start:stop], counts)
+        a_ind = np.repeat(np.arange(start, stop), counts)
+        yield a_ind, b_ind
+
+
+def _histogram_fft(a, b, bin_width, hist_width, n_bins, t0=None, oversample=FFT_OVERSAMPLE):
+    hist = np.zeros(n_bins)
+    if a.shape[0] == 0 or b.shape[0] == 0:
+        return hist
+
+    grid_ns = bin_width / oversample
+    grid = grid_ns / BIN_RESOLUTION_NS  # [tagger bins]
+    t0 = min(a[0], b[0]) if t0 is None else t0  # grid origin
+    cells_a = ((a - t0) // grid).astype(np.int64)
+    cells_b = ((b - t0) // grid).astype(np.int64)
+    n_cells = max(cells_a[-1], cells_b[-1]) + 1
+
+    # overlap-add: each segment of A cells is correlated with the B cells around it, lags -max_lag..max_lag
+    max_lag = ceil(hist_width / grid_ns)
+    n_fft = 1 << max(16, ceil(np.log2(4 * (2 * max_lag + 1))))
+    segment = n_fft - 2 * max_lag
+    corr = np.zeros(2 * max_lag + 1)
+    for start in range(0, n_cells, segment):
+        a_lo, a_hi = np.searchsorted(cells_a, [start, start + segment])
+        b_lo, b_hi = np.searchsorted(cells_b, [start - max_lag, start + segment + max_lag])
+        if a_hi == a_lo or b_hi == b_lo:
+            continue
+        grid_a = np.bincount(cells_a[a_lo:a_hi] - start, minlength=segment)
+        grid_b = np.bincount(cells_b[b_lo:b_hi] - (start - max_lag), minlength=n_fft)
+        spectrum = np.conj(np.fft.rfft(grid_a, n_fft)) * np.fft.rfft(grid_b, n_fft)
+        corr += np.fft.irfft(spectrum, n_fft)[: 2 * max_lag + 1]
+    corr = np.rint(corr)
+
+    dt = (np.arange(2 * max_lag + 1) - max_lag) * grid_ns  # [ns]
+    in_range = (dt >= -hist_width) & (dt <= hist_width)
+    bin_ind = np.floor((dt[in_range] + hist_width) / bin_width).astype(np.int64)
+    keep = bin_ind < n_bins
+    hist += np.bincount(bin_ind[keep], weights=corr[in_range][keep], minlength=n_bins)
+    return hist
 
 
 if __name__ == "__main__":
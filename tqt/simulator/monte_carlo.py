@@ -0,0 +1,88 @@
+"""
+Parallel Monte Carlo runner for simulated experiments
+
+Fans a list of parameter points out across a process pool. Every point (and every repeat of it) runs on its own
+virtual laser + time tagger, whose np.random.Generator is seeded from an independent np.random.SeedSequence
+stream. Results are therefore bit-reproducible for a given seed, whatever the number of workers.
+
+Typical usage:
+    def singles_vs_dark_rate(timetagger, dark_rate):
+        timetagger.dark_count_rate = dark_rate
+        timetagger.read(1.0)
+        return {"singles": timetagger.get_count_data([1])[1]}
+
+    df = run_monte_carlo(singles_vs_dark_rate, [{"dark_rate": r} for r in rates], seed=1234, repeats=10)
+
+The function must be defined at module level (not in a notebook cell or lambda) so worker processes can import it,
+and should draw any extra randomness from timetagger.rng to stay reproducible.
+"""
+
+import contextlib
+import io
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from tqt.simulator.laser_toptica_sim import TOpticaLaser
+from tqt.simulator.timetagger_uqd_sim import TimeTagger
+
+
+def run_monte_carlo(
+    func, points, seed=None, repeats=1, max_workers=None, laser_power=1.0, verbose=False
+):
+    """
+    Runs func(timetagger, **point) for every parameter point in a process pool and gathers the results.
+
+    Parameters
+    ----------
+    func: module-level function taking a TimeTagger (with an attached, emitting laser) and the point's parameters
+        as keyword arguments. Returns a dictionary of results (or a single value, stored as "result")
+    points: list of dictionaries of parameters, one per point
+    seed: root seed (int or np.random.SeedSequence). None draws fresh entropy
+    repeats: number of independent runs of each point
+    max_workers: number of worker processes, defaults to the number of CPUs
+    laser_power: laser power [mW] of each worker's virtual laser
+    verbose: if False, the [SIM] messages of the workers' drivers are suppressed
+
+    Returns
+    -------
+    df: pd.DataFrame with one row per (point, repeat): the parameters, a "repeat" column and the results
+    """
+    points = list(points)
+    root = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+    seeds = root.spawn(len(points) * repeats)
+    tasks = [
+        (func, point, repeat, seeds[i * repeats + repeat], laser_power, verbose)
+        for i, point in enumerate(points)
+        for repeat in range(repeats)
+    ]
+
+    max_workers = max_workers or os.cpu_count() or 1
+    chunksize = max(1, len(tasks) // (4 * max_workers))
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        rows = list(executor.map(_run_task, tasks, chunksize=chunksize))
+
+    return pd.DataFrame(rows)
+
+
+def _run_task(task):
+    func, point, repeat, seed_sequence, laser_power, verbose = task
+
+    with contextlib.ExitStack() as stack:
+        if not verbose:
+            stack.enter_context(contextlib.redirect_stdout(io.StringIO()))
+
+        laser = TOpticaLaser()
+        laser.set_power(laser_power)
+        laser.on()
+
+        timetagger = TimeTagger(seed=seed_sequence)
+        timetagger.attach_laser(laser)
+
+        result = func(timetagger, **point)
+
+    if not isinstance(result, dict):
+        result = {"result": result}
+    return {**point, "repeat": repeat, **result}
@@ -0,0 +1,141 @@
+import time
+import numpy as np
+
+from tqt.analysis.coincidences import count_coincidences
+from tqt.utils.io import IO, TAG_DTYPE
+
+
+class TimeTagger:
+    """
+    Drop-in time tagger that replays a recorded tag file instead of simulating the physics.
+
+    The capture is opened as a memory-mapped TagDataset (see IO.open_timetags) and read() advances a cursor
+    through it, one frame of time_s at a time. get_count_data() runs the software coincidence logic
+    (tqt.analysis.coincidences.count_coincidences) on the current frame, with the current window width and
+    channel delays, so a recording can be re-analysed through the GUI or any script written for the time tagger.
+
+    Parameters
+    ----------
+    filename: tag file to replay (.ttbin, .ttarc or .txt), relative to path
+    path: directory of the file, defaults to IO.default_path
+    realtime: if True, read(time_s) takes time_s like the hardware does, otherwise frames are replayed as fast
+        as possible (batch reprocessing)
+    loop: if True, the replay starts over at the end of the capture, otherwise the remaining frames are empty
+    """
+    _num_channels = 16
+
+    def __init__(self, filename, path=None, realtime=False, loop=True):
+        self.io = IO(path=path, verbose=False)
+        self.dataset = self.io.open_timetags(filename)
+        self.filename = filename
+        self.source_path = self.io.path.joinpath(filename).resolve()
+        self.realtime = realtime
+        self.loop = loop
+        print(f"[SIM] Replay Time Tagger initialized ({filename}, {self.dataset.duration_s:.2f} s of tags)")
+
+        self.logic_mode = True
+        self.window_width = 3.0
+        self.delays = [0.0] * self._num_channels
+        self.thresholds = [0.5] * self._num_channels
+
+        self.cursor_s = self.dataset.t_start_s
+        self._frame = self.dataset[self.cursor_s:self.cursor_s]
+        self._last_duration = 1.0
+
+    def get_info(self):
+        print(f"[SIM] FPGA Version: REPLAY | Resolution: 156.25ps | File: {self.filename}")
+
+    def close(self):
+        print("[SIM] Replay Time Tagger closed")
+
+    def switch_logic(self, mode="logic"):
+        if isinstance(mode, str):
+            self.logic_mode = (mode.lower() == "logic")
+        else:
+            self.logic_mode = not self.logic_mode
+        state = "Logic (Counter)" if self.logic_mode else "Time Tag (Raw Stream)"
+        print(f"[SIM] Switched to {state} Mode")
+
+    def attach_laser(self, laser):
+        # The recorded tags already are the laser's; kept for the simulator's interface
+        self.laser = laser
+
+    def rewind(self, t_s=None):
+        """Moves the replay cursor to t_s [s] from the start of the capture (default: the start)."""
+        self.cursor_s = self.dataset.t_start_s + (t_s or 0.0)
+
+    def read(self, time_s=1.0):
+        if time_s is None: time_s = 1.0
+        started = time.perf_counter()
+
+        self._frame = self._next_frame(time_s)
+        self._last_duration = time_s
+
+        if self.realtime:
+            time.sleep(max(0.0, time_s - (time.perf_counter() - started)))
+
+    def _next_frame(self, time_s):
+        """TagDataset view of the next time_s of the capture, advancing the cursor."""
+        end_s = self.dataset.t_start_s + self.dataset.duration_s
+        if self.loop and self.cursor_s >= end_s:
+            self.rewind()
+        frame = self.dataset[self.cursor_s:self.cursor_s + time_s]
+        self.cursor_s += time_s
+        return frame
+
+    def get_count_data(self, channels: list):
+        """
+        Returns (time, count, rate) of a channel pattern in the last frame read.
+        """
+        durations, counts, rates = self.get_count_data_many([channels])
+        return float(durations[0]), int(counts[0]), float(rates[0])
+
+    def get_count_data_many(self, patterns):
+        """
+        Vectorized get_count_data for a list of channel patterns, all read from the same frame.
+
+        Returns (durations, counts, rates) arrays with one entry per pattern.
+        """
+        return count_coincidences(self._frame, patterns, window_width=self.window_width, delays=self.delays,
+                                  duration_s=self._last_duration)
+
+    def set_window_width(self, window=3.0):
+        self.window_width = float(window)
+        print(f"[SIM] Coincidence window set to {window} ns")
+
+    def set_channel_time_delays(self, delays):
+        self.delays = list(delays)
+        print(f"[SIM] Delays updated: {delays[:3]}...")
+
+    def set_channel_voltage_thresholds(self, thresholds):
+        # Thresholds were applied when the tags were recorded
+        self.thresholds = list(thresholds)
+        print(f"[SIM] Thresholds updated: {thresholds[:3]}... (no effect on a replay)")
+
+    def save_tags(self, io=None, filename="tags", time=1.0, convert=True):
+        """
+        Returns the next `time` seconds of the capture as a TAG_DTYPE array (advancing the cursor), and writes them
+        to {filename}.txt, or with convert=False to {filename}.ttbin, if an IO object is given. Raises ValueError
+        if that is the file being replayed, which would be destroyed.
+        """
+        if io and io.timetag_file_path(filename, convert).resolve() == self.source_path:
+            raise ValueError(f"Cannot save tags over the file being replayed ({self.source_path})")
+        frame = self._next_frame(time)
+        tags = np.empty(len(frame), dtype=TAG_DTYPE)
+        tags["channel"], tags["time"] = frame.channels, frame.times
+        if io:
+            with io.open_timetag_writer(filename, convert, duration_s=time, num_channels=self._num_channels,
+                                        bin_resolution_ns=self.dataset.bin_resolution_ns) as (file_path, write):
+                write(tags)
+            print(f"[SIM] Saved {len(tags)} tags to {file_path}")
+        return tags
+
+    def iter_tags(self, time=1.0, chunk_s=1.0):
+        """
+        Generator over the next `time` seconds of the capture, in TAG_DTYPE chunks of chunk_s seconds.
+        """
+        chunk_start = 0.0
+        while chunk_start < time:
+            chunk_time = min(chunk_s, time - chunk_start)
+            yield self.save_tags(time=chunk_time)
+            chunk_start += chunk_time
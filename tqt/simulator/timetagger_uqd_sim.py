@@ -1,12 +1,15 @@
 import time
 import random
 import os
+import functools
+import math
 import numpy as np
 from itertools import product
-from collections import Counter
 import itertools
 from scipy.special import erf
 
+from tqt.utils.io import TAG_DTYPE
+
 BIN_RESOLUTION_NS = 0.15625
 j_sigma = 1.0
 
@@ -14,13 +17,14 @@ def complex_array(arr):
     return np.array(arr, dtype=complex)
 
 def CT(matrix): 
-    return np.conj(np.transpose(matrix))
+    return np.conj(np.swapaxes(matrix, -1, -2))
 
 def Proj(vec): 
     return np.matmul(vec, CT(vec))
 
-def rot(angle): 
-    return np.array([[np.cos(angle), -np.sin(angle)], [np.sin(angle), np.cos(angle)]])
+def rot(angle): # Also accepts an array of K angles, returning (K, 2, 2)
+    c, s = np.cos(angle), np.sin(angle)
+    return np.moveaxis(np.array([[c, -s], [s, c]]), (0, 1), (-2, -1))
 
 def HWP(angle): # Half-wave plate rotation matrix
     return rot(angle) @ np.array([[1, 0], [0, -1]]) @ rot(-1*angle)
@@ -28,6 +32,125 @@ def HWP(angle): # Half-wave plate rotation matrix
 def QWP(angle): # Quarter-wave plate rotation matrix
     return rot(angle) @ np.array([[1, 0], [0, -1j]]) @ rot(-1*angle)
 
+def outcome_probabilities(rho, stacked_ops):
+    """
+    Probabilities of all 2^N ideal outcomes in a single tensor contraction.
+
+    rho is reshaped into a rank-2N tensor and each party's stacked POVM (outcome, row, col) is contracted
+    against its row/column index, i.e. Tr(rho E1 x ... x EN) without building any 2^N x 2^N operator.
+
+    Parameters
+    ----------
+    rho: (2^N, 2^N) density matrix
+    stacked_ops: list of N arrays of shape (2, 2, 2), one per party.
+        They may have leading (e.g. waveplate setting) axes, which are broadcast together
+
+    Returns
+    -------
+    probs: real array of shape (...,) + (2,)*N, indexed by each party's outcome
+        (same ordering as product([0, 1], repeat=N))
+    """
+    n = len(stacked_ops)
+    if rho.shape != (2**n, 2**n):
+        raise ValueError(f"rho has shape {rho.shape}, expected {(2**n, 2**n)} for {n} parties")
+
+    rows = list(range(n))
+    cols = list(range(n, 2 * n))
+    outs = list(range(2 * n, 3 * n))
+
+    # Tr(rho E) = sum_ij rho[i, j] E[j, i]
+    operands = [rho.reshape((2,) * (2 * n)), rows + cols]
+    for k, ops in enumerate(stacked_ops):
+        operands += [ops, [Ellipsis, outs[k], cols[k], rows[k]]]
+
+    return np.real(np.einsum(*operands, [Ellipsis] + outs, optimize=True))
+
+def sample_detections(rng, ideal_counts, channel_bits, efficiencies):
+    """
+    Applies independent per-channel losses to the ideal outcome counts.
+
+    Instead of enumerating the 2^N detection masks of every outcome, the counts are thinned one party at a time:
+    the events of each group are split into those whose photon was detected and those lost with one binomial
+    draw per group, doubling the groups. This is exact (a sequence of binomials is the multinomial over the
+    detection patterns) and its cost does not depend on the number of events.
+
+    Parameters
+    ----------
+    rng: np.random.Generator
+    ideal_counts: (..., K) number of emitted pairs that ended in each ideal outcome. Leading (e.g. frame) axes
+        are carried through
+    channel_bits: (K, N) bitmask (1 << (ch - 1)) of the channel each party's photon goes to in that outcome
+    efficiencies: (K, N) detection efficiency of those channels
+
+    Returns
+    -------
+    masks: (K, 2^N) bitmask of the channels that fired in each detection pattern of each outcome (0: none)
+    counts: (..., K, 2^N) number of events with that detection pattern
+    """
+    n_outcomes, n_parties = efficiencies.shape
+    counts = np.asarray(ideal_counts, dtype=np.int64)[..., None]
+    masks = np.zeros((n_outcomes, 1), dtype=np.int64)
+    for j in range(n_parties):
+        detected = rng.binomial(counts, efficiencies[:, j, None])
+        counts = np.concatenate([counts - detected, detected], axis=-1)
+        masks = np.concatenate([masks, masks | channel_bits[:, j, None]], axis=-1)
+    return masks, counts
+
+def channels_to_mask(channels, num_channels=16):
+    """Converts a list of (1-indexed) channels into a bitmask, or None if a channel is out of range."""
+    mask = 0
+    for ch in channels:
+        if not 1 <= ch <= num_channels:
+            return None
+        mask |= 1 << (ch - 1)
+    return mask
+
+def superset_sums(counts, num_channels=16):
+    """
+    Superset-sum (zeta) transform over channel bitmasks.
+    out[m] is the total of counts[s] over every pattern s that contains all the channels in m,
+    i.e. the number of events where (at least) the channels of m fired.
+    """
+    fired = np.flatnonzero(counts)
+    return superset_table(fired, counts[fired], num_channels)
+
+def superset_table(masks, counts, num_channels=16):
+    """
+    superset_sums of a frame given as (masks, counts) entries, without a dense 2^16 array of its patterns.
+
+    A frame only holds a few, low-order patterns, so each entry is expanded into its subsets and scattered,
+    which is much cheaper than the dense transform over all 2^16 masks (used when it is not).
+    """
+    masks = np.asarray(masks, dtype=np.int64)
+    counts = np.asarray(counts, dtype=np.int64)
+    out = np.zeros(1 << num_channels, dtype=np.int64)
+    n_subsets = np.left_shift(1, channel_bits_of(masks, num_channels).sum(axis=1))
+    if n_subsets.sum() > out.size:
+        np.add.at(out, masks, counts)
+        for bit in range(num_channels):
+            view = out.reshape(-1, 2, 1 << bit)
+            view[:, 0, :] += view[:, 1, :]
+        return out
+
+    for bit in np.flatnonzero(channel_bits_of([np.bitwise_or.reduce(masks)], num_channels)[0]):
+        has_bit = (masks >> bit) & 1 == 1
+        masks = np.concatenate([masks, masks[has_bit] & ~(1 << bit)])
+        counts = np.concatenate([counts, counts[has_bit]])
+    np.add.at(out, masks, counts)
+    return out
+
+@functools.lru_cache(maxsize=None)
+def pair_indices(n):
+    """(idx_a, idx_b) indices of every pair of n items (upper triangle), cached as it is needed every frame."""
+    idx_a, idx_b = np.triu_indices(n, k=1)
+    idx_a.flags.writeable = False
+    idx_b.flags.writeable = False
+    return idx_a, idx_b
+
+def channel_bits_of(masks, num_channels=16):
+    """(M, num_channels) 0/1 array of the channels (column ch - 1) in each bitmask."""
+    return (np.asarray(masks)[:, None] >> np.arange(num_channels)) & 1
+
 vec0 = complex_array([[1],[0]])
 vec1 = complex_array([[0],[1]])
 Id = complex_array([[1,0],[0,1]])
@@ -47,6 +170,7 @@ class QuantumParty:
 
         self.pbs_ops = [Proj(vec0), Proj(vec1)]
         self.ops = [] 
+        self.generation = 0 # bumped every time the operators change
         self.update_operators()
 
     def set_waveplates(self, hwp, qwp):
@@ -61,17 +185,47 @@ class QuantumParty:
         """
         W = HWP(self.hwp_angle) @ QWP(self.qwp_angle) if self.has_qwp else HWP(self.hwp_angle)
         self.ops = [CT(W) @ op @ W for op in self.pbs_ops]
+        self.stacked_ops = np.array(self.ops) # (outcome, row, col), used by outcome_probabilities
+        self.generation += 1
+
+    def operators_for(self, hwp, qwp):
+        """
+        Stacked operators (K, 2, 2, 2) for K waveplate settings at once (angles in radians),
+        without changing the party's own waveplates.
+        """
+        hwp, qwp = np.broadcast_arrays(np.atleast_1d(hwp), np.atleast_1d(qwp))
+        W = HWP(hwp) @ QWP(qwp) if self.has_qwp else HWP(hwp)
+        return np.stack([CT(W) @ op @ W for op in self.pbs_ops], axis=-3)
 
     def qwp_toggle(self):
         self.has_qwp = not self.has_qwp
         print("Toggled:", self.has_qwp)
         self.update_operators()
 
+class _TrackedList(list):
+    """
+    List that calls on_change whenever one of its elements is overwritten.
+    """
+    def __init__(self, values, on_change):
+        super().__init__(values)
+        self._on_change = on_change
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self._on_change()
+
 class TimeTagger:
     _num_channels = 16
+    _max_batch_cells = 5_000_000 # (frame, outcome, detection pattern) counts simulated at once by read_frames
 
-    def __init__(self):
+    def __init__(self, seed=None):
         print("[SIM] Virtual Time Tagger initialized (Poissonian Statistics)")
+        self.rng = np.random.default_rng(seed)
+        # Generation counter for rho and the efficiencies. Together with each party's generation it keys
+        # the cached outcome-probability table, so read() only rebuilds it when the physics changed
+        self._generation = 0
+        self._prob_cache_key = None
+        self._prob_cache = None
         self.source_type = 0 # 0: Sagnac, 1: |01> + i|10>, 2: |01><01| + |10><10|, 3: |+->
         self.stored_source_hwp_angle = 0.0
         self.logic_mode = True
@@ -89,7 +243,10 @@ class TimeTagger:
         self.laser_rate = 3 * 100000.0
         self.parties = []
         
-        self._simulation_memory = Counter()
+        self._frame_masks = np.zeros(0, dtype=np.int64)
+        self._frame_counts = np.zeros(0, dtype=np.int64)
+        self._superset_cache = None
+        self._accidental_matrix = np.zeros((self._num_channels, self._num_channels))
         self._last_duration = 1.0
 
         self.add_party("Alice", 1, 3)
@@ -124,6 +281,28 @@ class TimeTagger:
         self.channel_efficiencies[2] = 0.7
         self.channel_efficiencies[3] = 0.8"""
 
+    @property
+    def rho(self):
+        return self._rho
+
+    @rho.setter
+    def rho(self, value):
+        self._rho = value
+        self._bump_generation()
+
+    @property
+    def channel_efficiencies(self):
+        return self._channel_efficiencies
+
+    @channel_efficiencies.setter
+    def channel_efficiencies(self, values):
+        # Item writes (channel_efficiencies[0] = 0.09) also invalidate the cache
+        self._channel_efficiencies = _TrackedList(values, self._bump_generation)
+        self._bump_generation()
+
+    def _bump_generation(self):
+        self._generation += 1
+
     # --- Standard methods to match the actual TT ---
 
     def get_info(self):
@@ -147,189 +326,489 @@ class TimeTagger:
     def read(self, time_s=1.0):
         # print("read (optimized with accidentals):")
         if time_s is None: time_s = 1.0
-        temp_memory = Counter() 
+        # The frame is kept as (bitmask of the channels that fired together, count) entries
+        masks = [np.zeros(0, dtype=np.int64)]
+        counts = [np.zeros(0, dtype=np.int64)]
 
-        base_rate = 0.0
-        if self.laser:
-            if hasattr(self.laser, 'is_emission_on') and self.laser.is_emission_on:
-                 base_rate = self.laser.power * self.laser_rate # laser rate
+        base_rate = self._base_rate()
         
         if base_rate > 0:
             avg_events = base_rate * time_s
-            total_photons = np.random.poisson(avg_events)
+            total_photons = self.rng.poisson(avg_events)
             
-            # This generates counts for all parties
-            # Serves as a sort of cache, so that readings are consistent
             if total_photons > 0:
-                observable_probs = Counter() 
-                outcomes = list(product([0, 1], repeat=len(self.parties)))
-                
-                for outcome in outcomes:
-                    op_list = []
-                    channels_ideal = []
-                    
-                    for i, result_idx in enumerate(outcome):
-                        party = self.parties[i]
-                        op_list.append(party.ops[result_idx])
-                        channels_ideal.append(party.channels[result_idx])
-                    
-                    full_op = op_list[0]
-                    for op in op_list[1:]:
-                        full_op = np.kron(full_op, op)
-
-                    p_ideal = np.real(np.trace(self.rho @ full_op))
-
-                    if p_ideal <= 1e-9: continue
-
-                    effs = [self.channel_efficiencies[ch-1] if 1<=ch<=self._num_channels else 0.0 for ch in channels_ideal]
-                    
-                    for detection_mask in product([0, 1], repeat=len(channels_ideal)):
-                        p_loss_outcome = 1.0
-                        actual_channels = []
-                        
-                        for k, detected in enumerate(detection_mask):
-                            if detected == 1:
-                                p_loss_outcome *= effs[k]
-                                actual_channels.append(channels_ideal[k])
-                            else:
-                                p_loss_outcome *= (1 - effs[k])
-                        
-                        final_prob = p_ideal * p_loss_outcome
-                        if actual_channels:
-                            observable_probs[tuple(actual_channels)] += final_prob
-
-                patterns = list(observable_probs.keys())
-                probs = list(observable_probs.values())
-                
-                sum_p = sum(probs)
-                if sum_p > 1.0: 
-                    probs = [p/sum_p for p in probs]
-                    sum_p = 1.0
-                    
-                probs_with_remainder = probs + [1.0 - sum_p] 
+                channel_bits, effs, probs_with_remainder = self._outcome_table()
                 
                 # This adds Pr(correct)
-                counts_distribution = np.random.multinomial(total_photons, probs_with_remainder)
-                
-                for i, count in enumerate(counts_distribution[:-1]):
-                    if count > 0:
-                        temp_memory[patterns[i]] += count
+                ideal_counts = self.rng.multinomial(total_photons, probs_with_remainder)[:-1]
+                signal_masks, signal_counts = sample_detections(self.rng, ideal_counts, channel_bits, effs)
+                masks.append(signal_masks.ravel())
+                counts.append(signal_counts.ravel())
 
         """if self.laser and hasattr(self.laser, 'power') and len(self.parties) >= 2 and hasattr(self.laser, 'is_emission_on') and self.laser.is_emission_on:
             noise_rate = 27.8 * self.laser.power * 2
             avg_noise = noise_rate * time_s
-            n_noise_events = np.random.poisson(avg_noise)
+            n_noise_events = self.rng.poisson(avg_noise)
             if n_noise_events > 0:
                 alice_chs = self.parties[0].channels
                 bob_chs = self.parties[1].channels
                 possible_pairs = list(itertools.product(alice_chs, bob_chs))
-                pair_indices = np.random.randint(0, len(possible_pairs), n_noise_events)
+                pair_indices = self.rng.integers(0, len(possible_pairs), n_noise_events)
                 
                 for idx in pair_indices:
-                    pair_key = tuple(sorted(possible_pairs[idx]))
-                    temp_memory[pair_key] += 1"""  
+                    pattern_counts[channels_to_mask(possible_pairs[idx])] += 1"""  
 
         avg_dark = self.dark_count_rate * time_s
         
         # Get all active channels to apply dark counts to
-        active_channels = []
-        for p in self.parties:
-            active_channels.extend(p.channels)
-        active_channels = sorted(list(set(active_channels)))
-
-        for ch in active_channels:
-            n_dark = np.random.poisson(avg_dark)
-            if n_dark > 0:
-                # Write to temp instead of self._simulation_memory
-                temp_memory[(ch,)] += n_dark
-
-        # Calculate total counts per channel to determine accidental rates
-        channel_totals = Counter()
-        for pattern, count in temp_memory.items(): # Read from temp
-            for ch in pattern:
-                channel_totals[ch] += count
-
-        # Iterate over all pairs of channels to add accidental coincidences
-        for ch_a, ch_b in itertools.combinations(active_channels, 2):
-            N_a = channel_totals[ch_a]
-            N_b = channel_totals[ch_b]
-            
-            if N_a == 0 or N_b == 0: continue
+        active_channels = self._active_channels()
+        active_bits = np.left_shift(1, active_channels - 1)
+        masks.append(active_bits)
+        counts.append(self.rng.poisson(avg_dark, size=active_channels.size))
+        masks, counts = np.concatenate(masks), np.concatenate(counts)
 
-            R_a = N_a / time_s
-            R_b = N_b / time_s
-            
-            # Convert window from ns to seconds
-            w_seconds = self.window_width * 1e-9
-            
-            # Rate of accidentals = Ra * Rb * Window
-            # [Pr(Meas_A) + Pr(Dark_A)] * [Pr(Meas_B) + Pr(Dark_B)] * Window
-            avg_acc = R_a * R_b * w_seconds * time_s
-            
-            n_acc = np.random.poisson(avg_acc)
-            
-            # Final = Pr(correct) + [All Accidental Terms]
-            if n_acc > 0:
-                key = tuple(sorted((ch_a, ch_b)))
-                temp_memory[key] += n_acc
+        # Total counts per channel (every pattern containing it) to determine accidental rates
+        singles = counts @ channel_bits_of(masks, self._num_channels)
+        self._accidental_matrix = self._accidental_means(singles, time_s)
+
+        # Draw the accidentals of every pair of active channels at once (upper triangle)
+        idx_a, idx_b = pair_indices(active_channels.size)
+        avg_acc = self._accidental_matrix[active_channels[idx_a] - 1, active_channels[idx_b] - 1]
+        n_acc = self.rng.poisson(avg_acc)
+
+        # Final = Pr(correct) + [All Accidental Terms]
+        masks = np.concatenate([masks, active_bits[idx_a] | active_bits[idx_b]])
+        counts = np.concatenate([counts, n_acc])
 
         self._last_duration = time_s
-        self._simulation_memory = temp_memory
+        recorded = (masks != 0) & (counts > 0) # mask 0: no channel fired, not recorded
+        self._frame_masks, self._frame_counts = masks[recorded], counts[recorded]
+        self._superset_cache = None
 
-    def get_count_data(self, channels: list):
+    def read_frames(self, n_frames, time_s=1.0, patterns=None):
         """
-        Returns (time, count, rate).
-        Applies the Overlap Function to signal, but adds constant Accidental Noise.
+        Equivalent to calling read(time_s) followed by get_count_data() for every pattern, n_frames times,
+        but with the photon numbers, multinomials, dark counts and accidentals of all frames drawn as
+        batched array operations. The frame read() keeps for get_count_data() is left untouched.
+
+        Parameters
+        ----------
+        n_frames: number of frames to acquire
+        time_s: integration time of each frame [s]
+        patterns: list of channel lists to count. Defaults to every active channel, followed by every pair of them
+
+        Returns
+        -------
+        counts: (n_frames, len(patterns)) array of counts
         """
-        req_set = set(channels)
-        raw_counts = 0
-        
-        for pattern, count in self._simulation_memory.items():
-            if req_set.issubset(pattern):
-                raw_counts += count
+        if time_s is None: time_s = 1.0
+        active_channels = self._active_channels()
+        if patterns is None:
+            patterns = [[ch] for ch in active_channels] + [list(pair) for pair in itertools.combinations(active_channels, 2)]
 
-        if len(channels) == 2:
-            chA, chB = channels[0], channels[1]
-            
-            dA = self.delays[chA - 1] if 1 <= chA <= 16 else 0
-            dB = self.delays[chB - 1] if 1 <= chB <= 16 else 0
-            delta = dA - dB
-            # overlap_factor = np.exp(-(delta**2) / (2 * j_sigma**2))
-            # if overlap_factor < 1e-5: overlap_factor = 0
+        base_rate = self._base_rate()
 
-            # Changed it to use erf to calculate. Coinc window was not being factored in
-            delta = dA - dB
+        # Bound the memory used by the per-outcome detection counts of a batch of frames
+        frames_per_batch = int(max(1, min(n_frames, self._max_batch_cells // self._cells_per_frame())))
 
-            window_ns = self.window_width
-            sigma = j_sigma
+        counts = np.empty((n_frames, len(patterns)), dtype=np.int64)
+        for start in range(0, n_frames, frames_per_batch):
+            stop = min(start + frames_per_batch, n_frames)
+            counts[start:stop] = self._simulate_frames(stop - start, time_s, base_rate, active_channels, patterns)
+        return counts
 
-            upper_bound = (window_ns / 2.0 - delta) / (sigma * np.sqrt(2))
-            lower_bound = (-window_ns / 2.0 - delta) / (sigma * np.sqrt(2))
+    def _simulate_frames(self, n_frames, time_s, base_rate, active_channels, patterns, probs=None):
+        """
+        Batched read() + get_count_data() over n_frames frames, see read_frames.
+        Counts are kept per frame for the (few) channel patterns that actually occur rather than all 2^16.
+        probs optionally gives each frame its own (n_frames, 2^N + 1) outcome probabilities (with the
+        Pr(no pair) remainder last) over _outcome_channels, instead of the cached table.
+        """
+        active_bits = np.left_shift(1, active_channels - 1)
+        idx_a, idx_b = pair_indices(active_channels.size)
+        pair_bits = active_bits[idx_a] | active_bits[idx_b]
 
-            overlap_factor = 0.5 * (erf(upper_bound) - erf(lower_bound))
-            # -----
+        outcome_masks = np.zeros(0, dtype=np.int64)
+        outcome_counts = np.zeros((n_frames, 0), dtype=np.int64)
+        if base_rate > 0:
+            total_photons = self.rng.poisson(base_rate * time_s, size=n_frames)
+            if probs is None:
+                channel_bits, effs, probs_with_remainder = self._outcome_table()
+            else:
+                (channel_bits, effs), probs_with_remainder = self._outcome_channels(), probs
+
+            ideal_counts = self.rng.multinomial(total_photons, probs_with_remainder)[:, :-1]
+            masks, counts = sample_detections(self.rng, ideal_counts, channel_bits, effs)
+            outcome_masks = masks.ravel()
+            outcome_counts = counts.reshape(n_frames, -1)
+
+        # Per-frame counts of every distinct pattern (signal, dark singles and accidental pairs)
+        patterns_seen, inverse = np.unique(np.concatenate([outcome_masks, active_bits, pair_bits]), return_inverse=True)
+        n_seen = patterns_seen.size
+        one_hot = np.zeros((outcome_masks.size, n_seen), dtype=np.int64)
+        one_hot[np.arange(outcome_masks.size), inverse[:outcome_masks.size]] = 1
+        table = outcome_counts @ one_hot
+        table[:, patterns_seen == 0] = 0 # no channel fired, not recorded
+        single_cols = inverse[outcome_masks.size:outcome_masks.size + active_bits.size]
+        pair_cols = inverse[outcome_masks.size + active_bits.size:]
 
-            def get_single(ch):
-                c = 0
-                for pat, cnt in self._simulation_memory.items():
-                    if (ch,) == pat or ch in pat: c += cnt
-                return c
-            
-            NA = get_single(chA)
-            NB = get_single(chB)
-            
+        avg_dark = self.dark_count_rate * time_s
+        table[:, single_cols] += self.rng.poisson(avg_dark, size=(n_frames, active_channels.size))
+
+        # (n_seen, 16): which channels fire in each pattern
+        has_channel = (patterns_seen[:, None] >> np.arange(self._num_channels)) & 1
+        accidentals = self._accidental_means(table @ has_channel, time_s)
+        table[:, pair_cols] += self.rng.poisson(accidentals[:, active_channels[idx_a] - 1, active_channels[idx_b] - 1])
+
+        masks, is_pair, ch_a, ch_b = self._pattern_arrays(patterns)
+        contains = ((patterns_seen[:, None] & masks) == masks) & (masks >= 0)
+        raw_counts = table @ contains.astype(np.int64)
+
+        # Singles indexed by channel, column 0 (out of range) never fires
+        singles = np.column_stack([np.zeros(n_frames, dtype=np.int64), table @ has_channel])
+        ch_a = np.where((ch_a >= 1) & (ch_a <= self._num_channels), ch_a, 0)
+        ch_b = np.where((ch_b >= 1) & (ch_b <= self._num_channels), ch_b, 0)
+        return self._logic_counts(raw_counts, singles[:, ch_a], singles[:, ch_b], is_pair, ch_a, ch_b, time_s)
+
+    def _cells_per_frame(self, all_outcomes=False):
+        """Number of (outcome, detection pattern) counts _simulate_frames draws per frame."""
+        n_outcomes = (1 << len(self.parties)) if all_outcomes else self._outcome_table()[0].shape[0]
+        return max(n_outcomes << len(self.parties), 1)
+
+    def sweep_waveplates(self, hwp_angles=None, qwp_angles=None, time_s=1.0, patterns=None, sample=False):
+        """
+        Evaluates K waveplate settings in one broadcasted computation, e.g. for fringe or visibility curves.
+        Batched HWP/QWP matrices of shape (K, 2, 2) are built for every party and contracted with rho at once.
+        The parties' own waveplates are left untouched.
+
+        Parameters
+        ----------
+        hwp_angles: dictionary of party name -> array of K HWP angles [rad]. Parties not given keep their current angle
+        qwp_angles: dictionary of party name -> array of K QWP angles [rad]. Parties not given keep their current angle
+        time_s: integration time used for the counts [s]
+        patterns: list of channel lists to return counts for
+        sample: if True, the counts are simulated (as read() + get_count_data()), otherwise their expected values
+
+        Returns
+        -------
+        A dictionary with
+            "probs": (K, 2^N) ideal outcome probabilities, in product([0, 1], repeat=N) order
+            "counts": (K, len(patterns)) counts of each pattern, only if patterns is given
+        """
+        if time_s is None: time_s = 1.0
+        hwp_angles = {name.lower(): angles for name, angles in (hwp_angles or {}).items()}
+        qwp_angles = {name.lower(): angles for name, angles in (qwp_angles or {}).items()}
+
+        settings = [(np.asarray(hwp_angles.get(p.name.lower(), p.hwp_angle), dtype=float),
+                     np.asarray(qwp_angles.get(p.name.lower(), p.qwp_angle), dtype=float)) for p in self.parties]
+        n_settings = np.broadcast_shapes(*(np.shape(a) for setting in settings for a in setting), (1,))[0]
+
+        stacked_ops = [p.operators_for(np.broadcast_to(hwp, (n_settings,)), np.broadcast_to(qwp, (n_settings,)))
+                       for p, (hwp, qwp) in zip(self.parties, settings)]
+        probs = outcome_probabilities(self.rho, stacked_ops).reshape(n_settings, -1)
+
+        result = {"probs": probs}
+        if patterns is None:
+            return result
+
+        if not sample:
+            channel_bits, effs = self._outcome_channels()
+            result["counts"] = self._expected_counts(probs, channel_bits, effs, time_s, patterns)["counts"]
+            return result
+
+        # Same normalization as _outcome_table, per setting
+        clipped = np.where(probs > 1e-9, probs, 0.0)
+        clipped = clipped / np.maximum(clipped.sum(axis=1, keepdims=True), 1.0)
+        probs_with_remainder = np.column_stack([clipped, np.clip(1.0 - clipped.sum(axis=1), 0.0, None)])
+
+        base_rate = self._base_rate()
+        active_channels = self._active_channels()
+        per_batch = int(max(1, self._max_batch_cells // self._cells_per_frame(all_outcomes=True)))
+        counts = np.empty((n_settings, len(patterns)), dtype=np.int64)
+        for start in range(0, n_settings, per_batch):
+            stop = min(start + per_batch, n_settings)
+            counts[start:stop] = self._simulate_frames(stop - start, time_s, base_rate, active_channels, patterns,
+                                                       probs=probs_with_remainder[start:stop])
+        result["counts"] = counts
+        return result
+
+    def expected_counts(self, time_s=1.0, patterns=None):
+        """
+        Mean counts of a read(time_s) frame, computed analytically from the same rho, party operators,
+        efficiencies, dark count rate and overlap model, without any sampling.
+        Cheap enough to be used as the objective of scipy.optimize (e.g. maximizing CHSH over waveplate angles).
+        Accidentals are computed from the mean singles, and the integer truncation done by get_count_data is left out.
+
+        Returns
+        -------
+        A dictionary with
+            "singles": (16,) expected get_count_data([ch]) of every channel (index ch - 1)
+            "coincidences": (16, 16) expected get_count_data([ch_a, ch_b]) of every pair of channels (zero diagonal)
+            "accidentals": (16, 16) the accidental part of "coincidences"
+            "counts": (len(patterns),) expected get_count_data(pattern) of each pattern, only if patterns is given
+        """
+        if time_s is None: time_s = 1.0
+        channel_bits, effs, probs_with_remainder = self._outcome_table()
+        return self._expected_counts(probs_with_remainder[:-1], channel_bits, effs, time_s, patterns)
+
+    def _expected_counts(self, probs, channel_bits, effs, time_s, patterns=None):
+        """
+        See expected_counts. probs are the (..., K) probabilities of the K ideal outcomes described by
+        channel_bits and effs (K, N); any leading axes (e.g. waveplate settings) are carried through.
+        """
+        n_ch = self._num_channels
+        probs = np.asarray(probs, dtype=float)
+        n_pairs = self._base_rate() * time_s
+        single_bits = np.left_shift(1, np.arange(n_ch))
+        outcome_masks = np.bitwise_or.reduce(channel_bits, axis=1)
+        p_any = 1.0 - np.prod(1.0 - effs, axis=1) # at least one click, i.e. recorded at all
+
+        def signal(masks):
+            # Pr(all channels of the mask fire) for each outcome, then averaged over the outcomes
+            contained = (outcome_masks[:, None] & masks) == masks
+            in_mask = (channel_bits[:, None, :] & masks[None, :, None]) != 0
+            p_fire = np.where(in_mask, effs[:, None, :], 1.0).prod(axis=2)
+            p_fire = np.where(masks == 0, p_any[:, None], p_fire)
+            return n_pairs * (probs @ (contained * p_fire))
+
+        dark = np.zeros(n_ch)
+        dark[self._active_channels() - 1] = self.dark_count_rate * time_s
+
+        # Accidentals added by read(), from the singles before accidentals
+        accidentals_read = self._accidental_means(signal(single_bits) + dark, time_s)
+        idx_a, idx_b = pair_indices(n_ch)
+        pair_bits = single_bits[idx_a] | single_bits[idx_b]
+        accidentals_pairs = accidentals_read[..., idx_a, idx_b]
+
+        def raw(masks):
+            # Mean "all of these channels fired" counts, split into the signal and the dark + accidental part
+            valid = masks >= 0
+            masks = np.where(valid, masks, 0)
+            noise = (dark @ ((single_bits[:, None] & masks) == masks)
+                     + accidentals_pairs @ ((pair_bits[:, None] & masks) == masks))
+            return np.where(valid, signal(masks), 0.0), np.where(valid, noise, 0.0)
+
+        singles = sum(raw(single_bits))
+        # Indexed by channel, column 0 (out of range) never fires
+        singles_ext = np.concatenate([np.zeros(singles.shape[:-1] + (1,)), singles], axis=-1)
+        window_s = self.window_width * 1e-9
+
+        def logic(masks, is_pair, ch_a, ch_b):
+            # Same as _logic_counts, returning the counts and their accidental part
+            signal_counts, noise_counts = raw(masks)
+            ch_a = np.where((ch_a >= 1) & (ch_a <= n_ch), ch_a, 0)
+            ch_b = np.where((ch_b >= 1) & (ch_b <= n_ch), ch_b, 0)
+            overlap = self._overlap_factors(ch_a, ch_b)
+            accidentals = noise_counts * overlap + singles_ext[..., ch_a] * singles_ext[..., ch_b] * window_s / time_s
+            counts = np.where(is_pair, signal_counts * overlap + accidentals, signal_counts + noise_counts)
+            return counts, np.where(is_pair, accidentals, 0.0)
+
+        grid_a, grid_b = np.meshgrid(np.arange(1, n_ch + 1), np.arange(1, n_ch + 1), indexing="ij")
+        grid_a, grid_b = grid_a.ravel(), grid_b.ravel()
+        off_diagonal = grid_a != grid_b
+        coincidences, accidentals = logic(single_bits[grid_a - 1] | single_bits[grid_b - 1],
+                                          off_diagonal, grid_a, grid_b)
+        shape = coincidences.shape[:-1] + (n_ch, n_ch)
+
+        result = {
+            "singles": singles,
+            "coincidences": (coincidences * off_diagonal).reshape(shape),
+            "accidentals": accidentals.reshape(shape),
+        }
+        if patterns is not None:
+            result["counts"] = logic(*self._pattern_arrays(patterns))[0]
+        return result
+
+    @property
+    def _superset_counts(self):
+        """
+        "All of these channels fired" counts of the last frame for every channel subset, so queries are one lookup.
+        The transform is run once per frame, at its first query.
+        """
+        if self._superset_cache is None:
+            self._superset_cache = superset_table(self._frame_masks, self._frame_counts, self._num_channels)
+        return self._superset_cache
+
+    def _base_rate(self):
+        """Pair emission rate [Hz] from the attached laser, 0 if there is none or it is off."""
+        if self.laser and hasattr(self.laser, 'is_emission_on') and self.laser.is_emission_on:
+            return self.laser.power * self.laser_rate # laser rate
+        return 0.0
+
+    def _active_channels(self):
+        """Sorted array of the (in range) channels used by any party."""
+        channels = sorted(set(ch for p in self.parties for ch in p.channels))
+        return np.array([ch for ch in channels if 1 <= ch <= self._num_channels], dtype=np.int64)
+
+    def _accidental_means(self, singles, time_s):
+        """
+        Expected accidental coincidences between every pair of channels, R R^T * window * time,
+        with R = singles / time_s. The diagonal is zero. singles may have leading (e.g. frame) axes.
+        """
+        rates = np.asarray(singles, dtype=float) / time_s
+        # Rate of accidentals = Ra * Rb * Window
+        # [Pr(Meas_A) + Pr(Dark_A)] * [Pr(Meas_B) + Pr(Dark_B)] * Window
+        matrix = rates[..., :, None] * rates[..., None, :] * (self.window_width * 1e-9) * time_s
+        diag = np.arange(rates.shape[-1])
+        matrix[..., diag, diag] = 0.0
+        return matrix
+
+    def get_accidental_matrix(self):
+        """
+        Returns the (16, 16) matrix of expected accidental coincidences that the last read() drew from,
+        for diagnostics. Channel n is row/column n - 1.
+        """
+        return self._accidental_matrix.copy()
+
+    def _outcome_channel_numbers(self):
+        """(2^N, N) channel each party's photon is routed to, for every ideal outcome in product([0, 1], repeat=N) order."""
+        outcomes = list(product([0, 1], repeat=len(self.parties)))
+        return np.array([[party.channels[result_idx] for party, result_idx in zip(self.parties, outcome)]
+                         for outcome in outcomes], dtype=np.int64).reshape(len(outcomes), len(self.parties))
+
+    def _outcome_channels(self):
+        """
+        (2^N, N) channel bitmasks and efficiencies of every ideal outcome, in product([0, 1], repeat=N) order.
+        """
+        channels = self._outcome_channel_numbers()
+        # Channels outside 1..16 are never detected
+        valid = (channels >= 1) & (channels <= self._num_channels)
+        ch_idx = np.clip(channels, 1, self._num_channels) - 1
+        channel_bits = np.where(valid, np.left_shift(1, ch_idx), 0)
+        effs = np.where(valid, np.asarray(self.channel_efficiencies)[ch_idx], 0.0)
+        return channel_bits, effs
+
+    def _outcome_table(self):
+        """
+        Returns (channel_bits, effs, probs_with_remainder) for one emitted pair:
+        the (K, N) channel bitmasks and efficiencies of each ideal outcome, and the K outcome
+        probabilities followed by the leftover Pr(no pair) entry used for the multinomial draw.
+        The table only depends on rho, the party operators, the efficiencies and the party channels, so it is
+        cached and rebuilt only when one of their generation counters or channels has changed.
+        """
+        key = (
+            self._generation,
+            tuple(p.generation for p in self.parties),
+            tuple(tuple(p.channels) for p in self.parties),
+        )
+        if key == self._prob_cache_key:
+            return self._prob_cache
+
+        ideal_probs = outcome_probabilities(self.rho, [p.stacked_ops for p in self.parties]).ravel()
+
+        # Outcomes are flattened in product([0, 1], repeat=N) order
+        keep = ideal_probs > 1e-9
+        channel_bits, effs = self._outcome_channels()
+        channel_bits, effs = channel_bits[keep], effs[keep]
+        probs = ideal_probs[keep]
+        sum_p = probs.sum()
+        if sum_p > 1.0:
+            probs = probs / sum_p
+            sum_p = 1.0
+        probs_with_remainder = np.append(probs, max(1.0 - sum_p, 0.0))
+
+        self._prob_cache_key = key
+        self._prob_cache = (channel_bits, effs, probs_with_remainder)
+        return self._prob_cache
+
+    def get_count_data(self, channels: list):
+        """
+        Returns (time, count, rate).
+        Applies the Overlap Function to signal, but adds constant Accidental Noise.
+        Same counts as get_count_data_many, computed on scalars as single queries are the common case in scripts.
+        """
+        mask = channels_to_mask(channels, self._num_channels)
+        raw_counts = int(self._superset_counts[mask]) if mask is not None else 0
+
+        if len(channels) == 2:
+            ch_a, ch_b = channels
+            NA, NB = (int(self._superset_counts[1 << (ch - 1)]) if 1 <= ch <= self._num_channels else 0
+                      for ch in (ch_a, ch_b))
             time_s = self._last_duration if self._last_duration > 0 else 1.0
             window_s = self.window_width * 1e-9
-            accidental_counts = np.random.poisson(int((float(NA) * float(NB) * window_s) / time_s))
-            final_counts = (raw_counts * overlap_factor) + accidental_counts
-            total_counts = int(final_counts)
-            
+            accidental_counts = self.rng.poisson(math.floor(float(NA) * float(NB) * window_s / time_s))
+            d_a = self.delays[ch_a - 1] if 1 <= ch_a <= self._num_channels else 0.0
+            d_b = self.delays[ch_b - 1] if 1 <= ch_b <= self._num_channels else 0.0
+            delta = d_a - d_b
+            upper_bound = (self.window_width / 2.0 - delta) / (j_sigma * math.sqrt(2))
+            lower_bound = (-self.window_width / 2.0 - delta) / (j_sigma * math.sqrt(2))
+            overlap_factor = 0.5 * (math.erf(upper_bound) - math.erf(lower_bound))
+            total_counts = int((raw_counts * overlap_factor) + accidental_counts)
         else:
             total_counts = raw_counts
 
-        rate = total_counts / self._last_duration if self._last_duration > 0 else 0
-        return self._last_duration, total_counts, rate
-        
+        rate = total_counts / self._last_duration if self._last_duration > 0 else 0.0
+        return float(self._last_duration), total_counts, float(rate)
+
+    def get_count_data_many(self, patterns):
+        """
+        Vectorized get_count_data for a list of channel patterns, all read from the same frame.
+        The overlap factors and accidentals of every two-channel pattern are computed in one pass.
+
+        Returns (durations, counts, rates) arrays with one entry per pattern.
+        """
+        masks, is_pair, ch_a, ch_b = self._pattern_arrays(patterns)
+        raw_counts = np.where(masks >= 0, self._superset_counts[np.clip(masks, 0, None)], 0)
+
+        NA = self._singles(ch_a)
+        NB = self._singles(ch_b)
+
+        time_s = self._last_duration if self._last_duration > 0 else 1.0
+        counts = self._logic_counts(raw_counts, NA, NB, is_pair, ch_a, ch_b, time_s)
+        durations = np.full(len(patterns), float(self._last_duration))
+        rates = counts / self._last_duration if self._last_duration > 0 else np.zeros(len(patterns))
+        return durations, counts, rates
+
+    def _logic_counts(self, raw_counts, NA, NB, is_pair, ch_a, ch_b, time_s):
+        """
+        Turns raw "all of these channels fired" counts into the counts get_count_data reports.
+        Coincidences: the signal is reduced by the overlap function, plus constant accidental noise.
+        Works on any leading (e.g. frame) axes, the pattern axis is last.
+        """
+        window_s = self.window_width * 1e-9
+        NA = np.asarray(NA, dtype=float)
+        NB = np.asarray(NB, dtype=float)
+        accidental_counts = self.rng.poisson(np.where(is_pair, np.floor(NA * NB * window_s / time_s), 0))
+        final_counts = (raw_counts * self._overlap_factors(ch_a, ch_b)) + accidental_counts
+        return np.where(is_pair, final_counts.astype(np.int64), raw_counts)
+
+    def _pattern_arrays(self, patterns):
+        """
+        Converts a list of channel patterns into arrays: the bitmask of each (-1 if a channel is out of range),
+        whether it is a two-channel coincidence, and its two channels (0 for anything else).
+        """
+        masks = np.array([-1 if m is None else m for m in
+                          (channels_to_mask(ch, self._num_channels) for ch in patterns)], dtype=np.int64)
+        is_pair = np.array([len(ch) == 2 for ch in patterns], dtype=bool)
+        ch_a = np.array([ch[0] if len(ch) == 2 else 0 for ch in patterns], dtype=np.int64)
+        ch_b = np.array([ch[1] if len(ch) == 2 else 0 for ch in patterns], dtype=np.int64)
+        return masks, is_pair, ch_a, ch_b
+
+    def _singles(self, channels):
+        """Singles of each channel in the last frame, 0 for channels out of range (they never fire)."""
+        channels = np.asarray(channels)
+        valid = (channels >= 1) & (channels <= self._num_channels)
+        masks = np.left_shift(1, np.clip(channels, 1, self._num_channels) - 1)
+        return np.where(valid, self._superset_counts[masks], 0)
+
+    def _overlap_factors(self, ch_a, ch_b):
+        """
+        Fraction of true coincidences between ch_a and ch_b that fall inside the coincidence window,
+        given their relative delay and the Gaussian timing jitter.
+        """
+        delays = np.append(0.0, np.asarray(self.delays, dtype=float)) # channel 0 / out of range -> no delay
+        ch_a = np.where((ch_a >= 1) & (ch_a <= self._num_channels), ch_a, 0)
+        ch_b = np.where((ch_b >= 1) & (ch_b <= self._num_channels), ch_b, 0)
+        delta = delays[ch_a] - delays[ch_b]
+
+        # Changed it to use erf to calculate. Coinc window was not being factored in
+        window_ns = self.window_width
+        sigma = j_sigma
+
+        upper_bound = (window_ns / 2.0 - delta) / (sigma * np.sqrt(2))
+        lower_bound = (-window_ns / 2.0 - delta) / (sigma * np.sqrt(2))
+
+        return 0.5 * (erf(upper_bound) - erf(lower_bound))
 
     def set_window_width(self, window=3.0):
         self.window_width = float(window)
@@ -353,96 +832,142 @@ class TimeTagger:
     def save_tags(self, io=None, filename="tags", time=1.0, convert=True):
         """
         Generates raw time tags that respect the CURRENT QUANTUM STATE.
+
+        Returns the tags as a structured array of dtype TAG_DTYPE (fields 'channel' and 'time' [bins]),
+        sorted by time. If an IO object is given they are also written to {filename}.txt, or with convert=False
+        to the compact binary {filename}.ttbin (see tqt.utils.io.IO.open_timetag_writer).
         """
         print(f"[SIM] Generating {time}s of physics-based tags...")
         
-        base_rate = 0.0
-        if self.laser and self.laser.is_emission_on:
-             base_rate = self.laser.power * self.laser_rate
+        base_rate = self._base_rate()
 
         if base_rate == 0:
-            self._write_tags_file(io, filename, [])
-            return
+            tags = np.zeros(0, dtype=TAG_DTYPE)
+            self._write_tags_file(io, filename, tags, time, convert)
+            return tags
 
         num_events = int(base_rate * time)
-        
-        probs_map = {}
-        outcomes = list(product([0, 1], repeat=len(self.parties))) # 0=Ch_A, 1=Ch_B
-        
-        total_prob = 0
-        for outcome in outcomes:
-            op_list = []
-            channels = []
-            for i, result_idx in enumerate(outcome):
-                p = self.parties[i]
-                op_list.append(p.ops[result_idx])
-                channels.append(p.channels[result_idx]) 
-            
-            full_op = op_list[0]
-            for op in op_list[1:]:
-                full_op = np.kron(full_op, op)
-                
-            p = np.real(np.trace(self.rho @ full_op))
 
-            eff = 1.0
-            for ch in channels:
-                eff *= self.channel_efficiencies[ch-1] if 1<=ch<=16 else 0
-                
-            probs_map[tuple(channels)] = p * eff
-            total_prob += p * eff
+        intervals = self.rng.exponential(1/base_rate, num_events)
+        emission_times_s = np.cumsum(intervals)
 
-        tags = []
+        tags = self._tags_from_emissions(emission_times_s)
+        self._write_tags_file(io, filename, tags, time, convert)
+        return tags
 
-        intervals = np.random.exponential(1/base_rate, num_events)
-        emission_times_s = np.cumsum(intervals)
+    def iter_tags(self, time=1.0, chunk_s=1.0):
+        """
+        Generator over the tags of a `time` second capture, yielded in time-ordered TAG_DTYPE chunks of about
+        chunk_s seconds of emissions each. Memory use is bounded by the chunk size, whatever the capture length,
+        and concatenating the chunks gives one time-sorted capture.
+        """
+        base_rate = self._base_rate()
+        if base_rate == 0:
+            return
 
-        pair_keys = list(probs_map.keys())
-        pair_probs = list(probs_map.values())
-        
-        sum_p = sum(pair_probs)
-        prob_no_click = 1.0 - sum_p
-        if prob_no_click < 0: prob_no_click = 0
-        
-        distribution = np.random.multinomial(num_events, pair_probs + [prob_no_click])
-        
-        current_event_idx = 0
-        for i, count in enumerate(distribution[:-1]): 
-            if count == 0: continue
-            
-            active_channels = pair_keys[i] 
-            
-            start_idx = current_event_idx
-            end_idx = current_event_idx + count
-            if end_idx > len(emission_times_s): break
-            
-            these_times = emission_times_s[start_idx:end_idx]
-            current_event_idx += count
-            
-            for ch in active_channels:
-                delay = self.delays[ch-1] if 1<=ch<=16 else 0
-                jitter = np.random.normal(0, j_sigma, count)
-        
-                times_ns = (these_times * 1e9) + delay + jitter
-                bins = (times_ns / BIN_RESOLUTION_NS).astype(np.int64)
-                
-                for b in bins:
-                    tags.append([ch, b])
-                    
-        # Sort and Save
-        tags.sort(key=lambda x: x[1])
-        self._write_tags_file(io, filename, tags)
+        # Delay and jitter move tags past the end of their emission chunk. Tags are only released once no
+        # later emission can land before them (up to jitter_guard standard deviations of jitter)
+        jitter_guard = 10
+        active_channels = self._active_channels()
+        min_delay = min([self.delays[ch - 1] for ch in active_channels], default=0.0)
+
+        pending = np.zeros(0, dtype=TAG_DTYPE)
+        chunk_start = 0.0
+        while chunk_start < time:
+            chunk_stop = min(chunk_start + chunk_s, time)
+
+            # Poisson emission process restarted at the chunk boundary (memoryless)
+            emission_times_s = self._emission_times(base_rate, chunk_start, chunk_stop)
+            new_tags = self._tags_from_emissions(emission_times_s)
+
+            merged = np.concatenate([pending, new_tags])
+            merged = merged[np.argsort(merged["time"], kind="stable")]
+
+            if chunk_stop < time:
+                release_ns = chunk_stop * 1e9 + min_delay - jitter_guard * j_sigma
+                n_release = np.searchsorted(merged["time"], release_ns / BIN_RESOLUTION_NS, side="left")
+            else:
+                n_release = merged.size
+            pending = merged[n_release:]
+
+            if n_release > 0:
+                yield merged[:n_release]
+            chunk_start = chunk_stop
+
+    def stream_tags(self, io, filename="tags", time=1.0, chunk_s=1.0, convert=True):
+        """
+        Generates a `time` second capture chunk by chunk (see iter_tags) and appends every chunk to
+        {filename}.txt (or {filename}.ttbin with convert=False) as it is produced,
+        so arbitrarily long captures use constant memory.
+        Returns the number of tags written.
+        """
+        print(f"[SIM] Streaming {time}s of physics-based tags in {chunk_s}s chunks...")
+        with io.open_timetag_writer(filename, convert, duration_s=time, num_channels=self._num_channels,
+                                    bin_resolution_ns=BIN_RESOLUTION_NS) as (file_path, write):
+            n_tags = 0
+            for tags in self.iter_tags(time=time, chunk_s=chunk_s):
+                write(tags)
+                n_tags += tags.size
+
+        print(f"[SIM] Saved {n_tags} tags to {file_path}")
+        return n_tags
+
+    def _emission_times(self, base_rate, start_s, stop_s):
+        """Sorted pair emission times [s] of a Poisson process at base_rate on [start_s, stop_s)."""
+        expected = base_rate * (stop_s - start_s)
+        times = []
+        t = start_s
+        while t < stop_s:
+            # Draw a few more intervals than expected so one pass is almost always enough
+            block = t + np.cumsum(self.rng.exponential(1/base_rate, int(expected + 5 * np.sqrt(expected) + 10)))
+            times.append(block[block < stop_s])
+            t = block[-1]
+        return np.concatenate(times) if times else np.zeros(0)
+
+    def _tag_outcomes(self):
+        """
+        (K, N) channels of every ideal outcome and the probability that a pair ends in it with every photon detected.
+        Tags are only generated for these full coincidences.
+        """
+        ideal_probs = outcome_probabilities(self.rho, [p.stacked_ops for p in self.parties]).ravel()
+        _, effs = self._outcome_channels()
+        return self._outcome_channel_numbers(), ideal_probs * np.prod(effs, axis=1)
+
+    def _tags_from_emissions(self, emission_times_s):
+        """
+        Assigns an outcome to every pair emitted at emission_times_s [s] and returns the resulting tags
+        (one per detected photon, with delay and jitter applied) as a TAG_DTYPE array sorted by time.
+        """
+        channels, pair_probs = self._tag_outcomes()
+        n_outcomes, n_parties = channels.shape
+
+        prob_no_click = max(1.0 - pair_probs.sum(), 0.0)
+        probs = np.append(pair_probs, prob_no_click)
+        outcome = self.rng.choice(n_outcomes + 1, size=emission_times_s.size, p=probs / probs.sum())
+
+        detected = outcome < n_outcomes
+        tag_channels = channels[outcome[detected]].ravel()
+        tag_times_s = np.repeat(emission_times_s[detected], n_parties)
+
+        delays = np.append(0.0, np.asarray(self.delays, dtype=float)) # channel 0 / out of range -> no delay
+        jitter = self.rng.normal(0, j_sigma, tag_channels.size)
+        in_range = (tag_channels >= 1) & (tag_channels <= self._num_channels)
+        times_ns = (tag_times_s * 1e9) + delays[np.where(in_range, tag_channels, 0)] + jitter
+        bins = (times_ns / BIN_RESOLUTION_NS).astype(np.int64)
+
+        order = np.argsort(bins, kind="stable")
+        tags = np.empty(bins.size, dtype=TAG_DTYPE)
+        tags["channel"] = tag_channels[order]
+        tags["time"] = bins[order]
+        return tags
     
-    def _write_tags_file(self, io, filename, tags_list):
+    def _write_tags_file(self, io, filename, tags, time=0.0, convert=True):
         if io:
-            file_path = io.path.joinpath(f"{filename}.txt")
-            file_path.parent.mkdir(parents=True, exist_ok=True)
-            
-            with open(file_path, "w") as f:
-                f.write("Channel\tTime\n") 
-                for row in tags_list:
-                    f.write(f"{int(row[0])}\t{int(row[1])}\n")
+            with io.open_timetag_writer(filename, convert, duration_s=time, num_channels=self._num_channels,
+                                        bin_resolution_ns=BIN_RESOLUTION_NS) as (file_path, write):
+                write(tags)
             
-            print(f"[SIM] Saved {len(tags_list)} tags to {file_path}")
+            print(f"[SIM] Saved {len(tags)} tags to {file_path}")
 
     def set_waveplates(self, party_name, hwp_angle, qwp_angle):
         """
@@ -1,4 +1,5 @@
 import pathlib
+import contextlib
 import warnings
 import os
 import datetime
@@ -7,10 +8,637 @@ import json
 import string
 import pandas as pd
 import random
+import struct
+import zlib
+import lzma
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 
 from tqt.utils import current_time
 
 
+# One time tag: channel number and arrival time in units of the tagger's bin resolution
+TAG_DTYPE = np.dtype([("channel", "u1"), ("time", "i8")])
+
+# Binary time-tag files (.ttbin): a 64-byte little-endian header, then the tags (sorted by time) as two contiguous
+# columns: the int64 times and the packed uint8 channels. The header holds the format version, number of channels,
+# bin resolution [ns], capture duration [s], number of tags and the byte offsets of the two columns.
+TIMETAG_MAGIC = b"TQTTAGS\0"
+TIMETAG_VERSION = 2
+_TIMETAG_HEADER = struct.Struct("<8sIIddQQQ8x")
+
+
+def read_timetag_header(path):
+    """
+    Returns the header of a binary time-tag file as a dictionary, or None if the file is not one.
+    """
+    with open(path, "rb") as f:
+        raw = f.read(_TIMETAG_HEADER.size)
+    if len(raw) < _TIMETAG_HEADER.size or not raw.startswith(TIMETAG_MAGIC):
+        return None
+    (
+        _,
+        version,
+        num_channels,
+        bin_resolution_ns,
+        duration_s,
+        n_tags,
+        times_offset,
+        channels_offset,
+    ) = _TIMETAG_HEADER.unpack(raw)
+    if version != TIMETAG_VERSION:
+        raise ValueError(f"{path}: unsupported time-tag file version {version}")
+    return dict(
+        version=version,
+        num_channels=num_channels,
+        bin_resolution_ns=bin_resolution_ns,
+        duration_s=duration_s,
+        n_tags=n_tags,
+        times_offset=times_offset,
+        channels_offset=channels_offset,
+    )
+
+
+def map_timetag_columns(path, header):
+    """
+    Memory-maps the (channels, times) columns of a binary time-tag file, read-only and without copying.
+    """
+    n_tags = header["n_tags"]
+    if n_tags == 0:
+        return np.zeros(0, dtype=np.uint8), np.zeros(0, dtype=np.int64)
+    channels = np.memmap(path, dtype=np.uint8, mode="r", offset=header["channels_offset"], shape=(n_tags,))
+    times = np.memmap(path, dtype="<i8", mode="r", offset=header["times_offset"], shape=(n_tags,))
+    return channels, times
+
+
+def tag_columns(tags):
+    """
+    Splits tags into (channels, times) arrays, whether they are a TAG_DTYPE array or an (N, 2) array as loaded
+    from a text file, or a TagDataset. For TAG_DTYPE arrays (including memory-mapped files) these are views, not
+    copies.
+    """
+    if isinstance(tags, TagDataset):
+        return tags.channels, tags.times
+    if tags.dtype.names is not None:
+        return tags["channel"], tags["time"]
+    return tags[:, 0], tags[:, 1]
+
+
+# Time-tag archives (.ttarc) for long-term storage: a 64-byte header (format version, codec, number of channels,
+# bin resolution [ns], capture duration [s], number of tags and number of blocks), a table with the offset,
+# compressed size and tag count of every block, then the blocks. Each block holds a run of consecutive tags and is
+# compressed independently: its channel sequence, then for every channel present its first time followed by the
+# deltas to its next tags, stored in the smallest unsigned integer width that fits.
+ARCHIVE_MAGIC = b"TQTARCH\0"
+ARCHIVE_VERSION = 1
+ARCHIVE_CODECS = {"zlib": 0, "lzma": 1}
+_ARCHIVE_HEADER = struct.Struct("<8sIIIddQQ12x")
+_ARCHIVE_BLOCK = struct.Struct("<QQQ")
+_ARCHIVE_CHANNEL = struct.Struct("<BBQq")
+_DELTA_DTYPES = (np.dtype("<u1"), np.dtype("<u2"), np.dtype("<u4"), np.dtype("<u8"))
+
+
+def _encode_archive_block(channels, times, codec):
+    channels = np.asarray(channels, dtype=np.uint8)
+    times = np.asarray(times, dtype=np.int64)
+
+    parts = [channels.tobytes()]
+    for ch in np.unique(channels):
+        ch_times = times[channels == ch]
+        deltas = np.diff(ch_times)
+        largest = deltas.max() if deltas.size else 0
+        dtype = next(dt for dt in _DELTA_DTYPES if largest <= np.iinfo(dt).max)
+        parts.append(_ARCHIVE_CHANNEL.pack(ch, dtype.itemsize, ch_times.size, ch_times[0]))
+        parts.append(deltas.astype(dtype).tobytes())
+
+    payload = b"".join(parts)
+    if codec == "lzma":
+        return lzma.compress(payload)
+    return zlib.compress(payload, 6)
+
+
+def _decode_archive_block(data, n_tags, codec):
+    payload = lzma.decompress(data) if codec == "lzma" else zlib.decompress(data)
+
+    tags = np.empty(n_tags, dtype=TAG_DTYPE)
+    channels = np.frombuffer(payload, dtype=np.uint8, count=n_tags)
+    tags["channel"] = channels
+
+    position = n_tags
+    while position < len(payload):
+        ch, width, count, first = _ARCHIVE_CHANNEL.unpack_from(payload, position)
+        position += _ARCHIVE_CHANNEL.size
+        dtype = next(dt for dt in _DELTA_DTYPES if dt.itemsize == width)
+        deltas = np.frombuffer(payload, dtype=dtype, count=count - 1, offset=position)
+        position += deltas.nbytes
+
+        ch_times = np.empty(count, dtype=np.int64)
+        ch_times[0] = first
+        np.cumsum(deltas, out=ch_times[1:])
+        ch_times[1:] += first
+        tags["time"][channels == ch] = ch_times
+    return tags
+
+
+def save_timetag_archive(
+    path,
+    tags,
+    duration_s=0.0,
+    num_channels=16,
+    bin_resolution_ns=0.15625,
+    codec="zlib",
+    block_size=1 << 20,
+    max_workers=None,
+):
+    """
+    Writes time-sorted tags to a delta-encoded, compressed time-tag archive (see ARCHIVE_MAGIC).
+    Blocks of block_size tags are encoded in parallel threads.
+    """
+    if codec not in ARCHIVE_CODECS:
+        raise ValueError(f"Unknown codec '{codec}', expected one of {list(ARCHIVE_CODECS)}")
+    channels, times = tag_columns(tags)
+    if np.any(np.diff(times) < 0):
+        raise ValueError("Tags must be sorted by time to be archived")
+
+    n_tags = len(times)
+    starts = range(0, n_tags, block_size)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        blocks = list(
+            executor.map(
+                lambda start: _encode_archive_block(
+                    channels[start : start + block_size], times[start : start + block_size], codec
+                ),
+                starts,
+            )
+        )
+
+    path = pathlib.Path(path)
+    os.makedirs(path.parent, exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(
+            _ARCHIVE_HEADER.pack(
+                ARCHIVE_MAGIC,
+                ARCHIVE_VERSION,
+                ARCHIVE_CODECS[codec],
+                num_channels,
+                bin_resolution_ns,
+                duration_s,
+                n_tags,
+                len(blocks),
+            )
+        )
+        offset = _ARCHIVE_HEADER.size + _ARCHIVE_BLOCK.size * len(blocks)
+        for start, block in zip(starts, blocks):
+            block_tags = min(block_size, n_tags - start)
+            f.write(_ARCHIVE_BLOCK.pack(offset, len(block), block_tags))
+            offset += len(block)
+        for block in blocks:
+            f.write(block)
+
+
+def _is_archive(path):
+    with open(path, "rb") as f:
+        return f.read(len(ARCHIVE_MAGIC)) == ARCHIVE_MAGIC
+
+
+def _read_archive_header(path):
+    with open(path, "rb") as f:
+        raw = f.read(_ARCHIVE_HEADER.size)
+    _, version, _, num_channels, bin_resolution_ns, duration_s, n_tags, _ = _ARCHIVE_HEADER.unpack(raw)
+    return dict(
+        version=version,
+        num_channels=num_channels,
+        bin_resolution_ns=bin_resolution_ns,
+        duration_s=duration_s,
+        n_tags=n_tags,
+    )
+
+
+def load_timetag_archive(path, max_workers=None):
+    """
+    Reads a time-tag archive back into a TAG_DTYPE array, decompressing its blocks in parallel threads.
+    """
+    with open(path, "rb") as f:
+        header = f.read(_ARCHIVE_HEADER.size)
+        magic, version, codec_id, _, _, _, n_tags, n_blocks = _ARCHIVE_HEADER.unpack(header)
+        if magic != ARCHIVE_MAGIC:
+            raise ValueError(f"{path} is not a time-tag archive")
+        table = [
+            _ARCHIVE_BLOCK.unpack(f.read(_ARCHIVE_BLOCK.size)) for _ in range(n_blocks)
+        ]
+        blocks = []
+        for offset, size, _ in table:
+            f.seek(offset)
+            blocks.append(f.read(size))
+
+    codec = {v: k for k, v in ARCHIVE_CODECS.items()}[codec_id]
+    tags = np.empty(n_tags, dtype=TAG_DTYPE)
+    starts = np.concatenate([[0], np.cumsum([n for _, _, n in table])]).astype(np.int64)
+
+    def decode(i):
+        tags[starts[i] : starts[i + 1]] = _decode_archive_block(blocks[i], table[i][2], codec)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        list(executor.map(decode, range(n_blocks)))
+    return tags
+
+
+# Sidecar index (.ttidx) of a binary time-tag file: a 64-byte header (format version, number of channels, block
+# rows, number of tags, number of blocks and the fingerprint of the indexed file), the time of the first tag of every block of block_rows tags, the
+# start of every channel in the channel-major time column, then that column: the times of the channel-0 tags,
+# then of the channel-1 tags, and so on, each channel in time order.
+TIMETAG_INDEX_MAGIC = b"TQTTIDX\0"
+TIMETAG_INDEX_VERSION = 2
+_TIMETAG_INDEX_HEADER = struct.Struct("<8sIIQQQQ16x")
+
+
+def _timetag_fingerprint(path, channels, times, samples=1024):
+    """
+    CRC-32 of the header of a binary time-tag file and of samples of its columns (the first and last tags, and
+    every n_tags / samples-th tag), stored in the sidecar index to tell whether it still matches the file.
+    """
+    with open(path, "rb") as f:
+        crc = zlib.crc32(f.read(_TIMETAG_HEADER.size))
+    step = max(len(times) // samples, 1)
+    for column in (times, channels):
+        for part in (column[:samples], column[-samples:], column[::step]):
+            crc = zlib.crc32(np.ascontiguousarray(part).tobytes(), crc)
+    return crc
+
+
+def _part_path(path):
+    """Temporary path a file is written to before it is moved onto path."""
+    return path.with_name(path.name + ".part")
+
+
+class TimeTagIndex:
+    """
+    Sidecar index (.ttidx) of a binary time-tag file, used to read channel and time-range subsets of large
+    captures without scanning the whole file. It holds a copy of the file's time column, so it takes about as much
+    disk space again as the times (8 bytes per tag), and building it is one extra pass over the file. It is
+    therefore only built on request: by IO.index_timetags, TimeTagWriter(index=True), or a load_timetags call
+    selecting channels.
+
+    block_times holds the time of the first tag of every block of block_rows tags, a coarse time -> row table of
+    the file's time column. The index also keeps a channel-major copy of the time column, in which the tags of
+    each channel are contiguous, so that channel_times(ch) is a view that only touches that channel's tags, however
+    the channels are interleaved in the capture. Channels beyond num_channels are stored with channel 0.
+    The index is memory-mapped like the file. Its fingerprint of the file (see _timetag_fingerprint) tells whether
+    it is stale.
+    """
+
+    def __init__(self, block_times, channel_starts, times, block_rows=1 << 16, fingerprint=0):
+        self.fingerprint = fingerprint
+        self.block_rows = block_rows
+        self.block_times = block_times
+        self.channel_starts = channel_starts
+        self.num_channels = len(channel_starts) - 2
+        self.n_tags = len(times)
+        self._times = times
+
+    def channel_times(self, ch):
+        """Times [tagger bins] of the tags on channel ch (1 to num_channels), without copying."""
+        return self._times[self.channel_starts[ch] : self.channel_starts[ch + 1]]
+
+    def search(self, times, value, row_offset=0):
+        """
+        Returns the row of the first tag at or after value [tagger bins] in times, the file's time column from
+        row_offset on. block_times gives the block holding that tag, and only this block is searched.
+        """
+        block = int(np.searchsorted(self.block_times, value, side="left")) - 1
+        if block < 0:
+            return 0
+        lo = min(max(block * self.block_rows - row_offset, 0), len(times))
+        hi = min(max((block + 1) * self.block_rows - row_offset, 0), len(times))
+        return lo + int(np.searchsorted(times[lo:hi], value, side="left"))
+
+    @classmethod
+    def load(cls, path):
+        """Memory-maps a sidecar index, or returns None if path is not an index of this format version."""
+        with open(path, "rb") as f:
+            raw = f.read(_TIMETAG_INDEX_HEADER.size)
+        if len(raw) < _TIMETAG_INDEX_HEADER.size or not raw.startswith(TIMETAG_INDEX_MAGIC):
+            return None
+        _, version, num_channels, block_rows, n_tags, n_blocks, fingerprint = _TIMETAG_INDEX_HEADER.unpack(raw)
+        if version != TIMETAG_INDEX_VERSION:
+            return None
+
+        offset = _TIMETAG_INDEX_HEADER.size
+        block_times = np.fromfile(path, dtype="<i8", count=n_blocks, offset=offset)
+        offset += 8 * n_blocks
+        channel_starts = np.fromfile(path, dtype="<i8", count=num_channels + 2, offset=offset)
+        offset += 8 * (num_channels + 2)
+        if n_tags > 0:
+            times = np.memmap(path, dtype="<i8", mode="r", offset=offset, shape=(n_tags,))
+        else:
+            times = np.zeros(0, dtype=np.int64)
+        return cls(block_times, channel_starts, times, block_rows=block_rows, fingerprint=fingerprint)
+
+    @classmethod
+    def build(cls, path, channels, times, fingerprint, block_rows=1 << 16, num_channels=16):
+        """
+        Indexes existing tag columns (e.g. a memory-mapped file, whose fingerprint is given) one block at a time,
+        and saves the index.
+        """
+        writer = TimeTagIndexWriter(path, block_rows=block_rows, num_channels=num_channels)
+        for start in range(0, len(times), block_rows):
+            writer.add(channels[start : start + block_rows], times[start : start + block_rows])
+        writer.close(fingerprint)
+        return cls.load(path)
+
+
+class TimeTagIndexWriter:
+    """
+    Builds the sidecar TimeTagIndex of a binary time-tag file from its chunks of tags, as they are written.
+    The times of every channel are spooled to their own temporary file, and copied one after the other into the
+    index when the writer is closed.
+    """
+
+    def __init__(self, path, block_rows=1 << 16, num_channels=16):
+        self.path = pathlib.Path(path)
+        self.block_rows = block_rows
+        self.num_channels = num_channels
+        self.n_tags = 0
+        self._block_times = []
+        self._channel_counts = np.zeros(num_channels + 1, dtype=np.int64)
+        self._spools = {}
+        os.makedirs(self.path.parent, exist_ok=True)
+
+    def add(self, channels, times):
+        """Indexes the next chunk of (time-sorted) tags."""
+        if len(times) == 0:
+            return
+        times = np.asarray(times, dtype=np.int64)
+        first = -self.n_tags % self.block_rows
+        self._block_times.append(times[first :: self.block_rows])
+
+        # channels beyond num_channels are stored with channel 0
+        ch = np.asarray(channels, dtype=np.int64)
+        ch = np.where(ch <= self.num_channels, ch, 0)
+        counts = np.bincount(ch, minlength=self.num_channels + 1)
+        order = np.argsort(ch, kind="stable")
+        ends = np.cumsum(counts)
+        for c in np.flatnonzero(counts):
+            if c not in self._spools:
+                self._spools[c] = tempfile.TemporaryFile(dir=self.path.parent)
+            times[order[ends[c] - counts[c] : ends[c]]].astype("<i8").tofile(self._spools[c])
+        self._channel_counts += counts
+        self.n_tags += len(times)
+
+    def close(self, fingerprint):
+        """Writes the index of the file with the given fingerprint (see _timetag_fingerprint)."""
+        block_times = np.concatenate(self._block_times + [np.zeros(0, dtype=np.int64)]).astype("<i8")
+        channel_starts = np.zeros(self.num_channels + 2, dtype="<i8")
+        np.cumsum(self._channel_counts, out=channel_starts[1:])
+
+        part_path = _part_path(self.path)
+        with open(part_path, "wb") as f:
+            f.write(
+                _TIMETAG_INDEX_HEADER.pack(
+                    TIMETAG_INDEX_MAGIC,
+                    TIMETAG_INDEX_VERSION,
+                    self.num_channels,
+                    self.block_rows,
+                    self.n_tags,
+                    block_times.size,
+                    fingerprint,
+                )
+            )
+            block_times.tofile(f)
+            channel_starts.tofile(f)
+            for c in sorted(self._spools):
+                spool = self._spools[c]
+                spool.seek(0)
+                shutil.copyfileobj(spool, f)
+                spool.close()
+        self._spools = {}
+        os.replace(part_path, self.path)
+
+
+def timetag_index_path(path):
+    """Path of the sidecar index of a binary time-tag file."""
+    return pathlib.Path(path).with_suffix(".ttidx")
+
+
+class TimeTagWriter:
+    """
+    Writes a binary time-tag file incrementally: the times of each chunk of tags are appended to the file as they
+    arrive and its channels to a temporary file, which is copied after the times, and the header rewritten with the
+    final tag count and column offsets, when the writer is closed. Chunks must be given in time order.
+
+    The file is written next to path (with a .part suffix) and only moved onto path when the writer is closed,
+    so an existing file at path, e.g. one being read through a memory map, stays intact until then. If the
+    writer is left through an exception, the partial file is discarded.
+
+    If index is True, the sidecar TimeTagIndex is built along the way and saved next to the file (it takes about
+    as much disk space again as the time column, see TimeTagIndex).
+
+    Typical usage:
+        with TimeTagWriter(path, duration_s=10.0) as writer:
+            for chunk in chunks:
+                writer.write(chunk)
+    """
+
+    def __init__(
+        self, path, num_channels=16, bin_resolution_ns=0.15625, duration_s=0.0, index=False
+    ):
+        self.path = pathlib.Path(path)
+        self.num_channels = num_channels
+        self.bin_resolution_ns = bin_resolution_ns
+        self.duration_s = duration_s
+        self.n_tags = 0
+        self.index = TimeTagIndexWriter(timetag_index_path(self.path), num_channels=num_channels) if index else None
+
+        os.makedirs(self.path.parent, exist_ok=True)
+        self._part_path = _part_path(self.path)
+        self._file = open(self._part_path, "wb")
+        self._channels_file = tempfile.TemporaryFile(dir=self.path.parent)
+        self._write_header()
+
+    def write(self, tags):
+        channels, times = tag_columns(tags)
+        times = np.ascontiguousarray(times, dtype="<i8")
+        channels = np.ascontiguousarray(channels, dtype=np.uint8)
+        times.tofile(self._file)
+        channels.tofile(self._channels_file)
+        self.n_tags += times.size
+        if self.index is not None:
+            self.index.add(channels, times)
+
+    def close(self):
+        if self._file.closed:
+            return
+        self._channels_file.seek(0)
+        shutil.copyfileobj(self._channels_file, self._file)
+        self._channels_file.close()
+        self._write_header()
+        self._file.close()
+        os.replace(self._part_path, self.path)
+        if self.index is not None:
+            header = read_timetag_header(self.path)
+            self.index.close(_timetag_fingerprint(self.path, *map_timetag_columns(self.path, header)))
+
+    def _write_header(self):
+        position = self._file.tell()
+        self._file.seek(0)
+        self._file.write(
+            _TIMETAG_HEADER.pack(
+                TIMETAG_MAGIC,
+                TIMETAG_VERSION,
+                self.num_channels,
+                self.bin_resolution_ns,
+                self.duration_s,
+                self.n_tags,
+                _TIMETAG_HEADER.size,
+                _TIMETAG_HEADER.size + 8 * self.n_tags,
+            )
+        )
+        self._file.seek(max(position, _TIMETAG_HEADER.size))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        elif not self._file.closed:
+            self._file.close()
+            self._channels_file.close()
+            os.remove(self._part_path)
+
+
+class TagDataset:
+    """
+    Lazy, time-sorted collection of time tags, kept on disk (memory-mapped) until parts of it are needed.
+
+    dataset.channels, dataset.times: the channel and time [tagger bins] columns
+    dataset.channel(3): times of the channel-3 tags, read from the sidecar index (a view) if there is an up to date
+        one, otherwise found by a scan of the tags, and then cached
+    dataset[t0:t1]: the tags with t0 <= time < t1 [s] (from the start of the capture), as a TagDataset viewing
+        the same memory (no copy)
+    dataset.iter_chunks(chunk_s): consecutive time slices of chunk_s [s], also views
+
+    Typical usage:
+        dataset = io.open_timetags("time-tags.ttbin")
+        hist, hist_bins, hist_norm = cross_correlation_histogram(dataset[0.0:0.5], ch_a=1, ch_b=2)
+    """
+
+    def __init__(
+        self,
+        channels,
+        times,
+        bin_resolution_ns=0.15625,
+        duration_s=None,
+        t_start_s=0.0,
+        index=None,
+        row_offset=0,
+        bin_range=(None, None),
+    ):
+        self.channels = channels
+        self.times = times
+        self.bin_resolution_ns = bin_resolution_ns
+        self.t_start_s = t_start_s
+        self.index = index
+        self._row_offset = row_offset  # row of the first tag in the indexed file
+        self._bin_range = bin_range  # (start, stop) [tagger bins] of this slice of the indexed file
+        self._channel_cache = {}
+        if duration_s is None:
+            duration_s = self.times[-1] * bin_resolution_ns * 1e-9 - t_start_s if len(self) else 0.0
+        self.duration_s = duration_s
+
+    def __len__(self):
+        return len(self.times)
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            # tags by row, as TAG_DTYPE
+            times = self.times[key]
+            tags = np.empty(np.shape(times), dtype=TAG_DTYPE)
+            tags["channel"], tags["time"] = self.channels[key], times
+            return tags
+        if key.step is not None:
+            raise ValueError("TagDataset time slices do not support a step")
+        lo, hi = self.rows_between(key.start, key.stop)
+        start_bin, stop_bin = self._bin_range
+        if key.start is not None:
+            start_bin = self._to_bins(key.start) if start_bin is None else max(start_bin, self._to_bins(key.start))
+        if key.stop is not None:
+            stop_bin = self._to_bins(key.stop) if stop_bin is None else min(stop_bin, self._to_bins(key.stop))
+        end_s = self.t_start_s + self.duration_s
+        start = self.t_start_s if key.start is None else min(max(key.start, self.t_start_s), end_s)
+        stop = end_s if key.stop is None else min(max(key.stop, start), end_s)
+        return TagDataset(
+            self.channels[lo:hi],
+            self.times[lo:hi],
+            bin_resolution_ns=self.bin_resolution_ns,
+            duration_s=stop - start,
+            t_start_s=start,
+            index=self.index,
+            row_offset=self._row_offset + lo,
+            bin_range=(start_bin, stop_bin),
+        )
+
+    def rows_between(self, t_start=None, t_stop=None):
+        """Returns the (row_start, row_stop) range of the tags with t_start <= time < t_stop [s]."""
+        lo = 0 if t_start is None else self._search(self._to_bins(t_start))
+        hi = len(self) if t_stop is None else self._search(self._to_bins(t_stop))
+        return lo, max(lo, hi)
+
+    def _search(self, value):
+        if self.index is not None:
+            return self.index.search(self.times, value, row_offset=self._row_offset)
+        return int(np.searchsorted(self.times, value, side="left"))
+
+    def channel(self, ch):
+        """Times [tagger bins] of the tags on channel ch."""
+        if ch not in self._channel_cache:
+            if self.index is not None and 1 <= ch <= self.index.num_channels:
+                # the channel's tags are contiguous in the index: search the time range of this slice in them
+                times = self.index.channel_times(ch)
+                start, stop = self._bin_range
+                lo = 0 if start is None else int(np.searchsorted(times, start, side="left"))
+                hi = len(times) if stop is None else int(np.searchsorted(times, stop, side="left"))
+                times = times[lo : max(lo, hi)]
+            else:
+                times = self.times[self.channels == ch]
+            self._channel_cache[ch] = times
+        return self._channel_cache[ch]
+
+    def to_array(self):
+        """The tags as a TAG_DTYPE array in memory (a copy)."""
+        tags = np.empty(len(self), dtype=TAG_DTYPE)
+        tags["channel"], tags["time"] = self.channels, self.times
+        return tags
+
+    def select_channels(self, channels):
+        """TagDataset of the tags on the given channels only, read into memory (see channel)."""
+        channels = list(dict.fromkeys(channels))
+        parts = [self.channel(ch) for ch in channels]
+        times = np.concatenate(parts + [np.zeros(0, dtype=np.int64)])
+        tag_channels = np.repeat(np.array(channels, dtype=np.uint8), [len(part) for part in parts])
+        order = np.argsort(times, kind="stable")
+        return TagDataset(
+            tag_channels[order],
+            times[order],
+            bin_resolution_ns=self.bin_resolution_ns,
+            duration_s=self.duration_s,
+            t_start_s=self.t_start_s,
+        )
+
+    def iter_chunks(self, chunk_s=1.0):
+        """Yields consecutive time slices of chunk_s [s] covering the dataset."""
+        n_chunks = max(int(np.ceil(self.duration_s / chunk_s)), 1)
+        for i in range(n_chunks):
+            start = self.t_start_s + i * chunk_s
+            stop = start + chunk_s if i < n_chunks - 1 else None
+            yield self[start:stop]
+
+    def _to_bins(self, t_s):
+        # first whole bin at or after t_s, so that integer time columns are searched without a cast to float
+        return np.int64(np.ceil(t_s * 1e9 / self.bin_resolution_ns))
+
+
 class IO:
     """
     The IO class encapsulates all saving/loading features of data, figures, etc.
@@ -106,13 +734,190 @@ class IO:
             print(f"{current_time()} | Loaded from {full_path} successfully.")
         return df
 
-    def load_timetags(self, filename):
+    def load_timetags(self, filename, channels=None, t_start=None, t_stop=None):
+        """
+        Loads a time-tag file into memory, as an array.
+        Binary (.ttbin) files are read into a TAG_DTYPE array. To work on them without loading them, open them as a
+        memory-mapped TagDataset with open_timetags instead.
+        Archives (.ttarc) are decompressed into a TAG_DTYPE array.
+        Text files are parsed and returned as an (N, 2) float array of (channel, time) rows.
+
+        channels, t_start and t_stop [s] select a subset of the tags. For binary files only the time range is read,
+        and selecting channels uses the sidecar index (see TimeTagIndex) to read only their tags. The
+        index is built and saved first if it is missing or stale; if it cannot be written (e.g. a read-only data
+        directory), the channels are found by a scan of the file instead.
+        """
         full_path = self.path.joinpath(filename)
-        data = np.loadtxt(str(full_path), delimiter="\t", skiprows=1)
+        header = read_timetag_header(full_path)
+        if header is not None:
+            data = self._open_binary_timetags(full_path, header, build_index=channels is not None)
+            if t_start is not None or t_stop is not None:
+                data = data[t_start:t_stop]
+            if channels is not None:
+                data = data.select_channels(channels)
+            data = data.to_array()
+        else:
+            if _is_archive(full_path):
+                data = load_timetag_archive(full_path)
+                bin_resolution_ns = _read_archive_header(full_path)["bin_resolution_ns"]
+            else:
+                data = np.loadtxt(str(full_path), delimiter="\t", skiprows=1)
+                bin_resolution_ns = 0.15625
+            if channels is not None or t_start is not None or t_stop is not None:
+                start = None if t_start is None else t_start * 1e9 / bin_resolution_ns
+                stop = None if t_stop is None else t_stop * 1e9 / bin_resolution_ns
+                data = self._select_timetags(data, channels, start, stop)
+
         if self.verbose:
             print(f"{current_time()} | Loaded from {full_path} successfully.")
         return data
 
+    def open_timetags(self, filename):
+        """
+        Opens a time-tag file as a lazy TagDataset. Binary files stay memory-mapped and use their sidecar index if
+        it exists and is up to date (it is not built here, see index_timetags); archives and text files are read
+        into memory.
+        """
+        full_path = self.path.joinpath(filename)
+        header = read_timetag_header(full_path)
+        if header is not None:
+            return self._open_binary_timetags(full_path, header)
+
+        tags = self.load_timetags(filename)
+        channels, times = tag_columns(tags)
+        if not _is_archive(full_path):
+            return TagDataset(channels, times)
+        header = _read_archive_header(full_path)
+        return TagDataset(
+            channels,
+            times,
+            bin_resolution_ns=header["bin_resolution_ns"],
+            duration_s=header["duration_s"] or None,
+        )
+
+    def index_timetags(self, filename):
+        """
+        (Re)builds and saves the sidecar index of a binary time-tag file, e.g. one written without it.
+        """
+        full_path = self.path.joinpath(filename)
+        header = read_timetag_header(full_path)
+        channels, times = map_timetag_columns(full_path, header)
+        return TimeTagIndex.build(
+            timetag_index_path(full_path),
+            channels,
+            times,
+            _timetag_fingerprint(full_path, channels, times),
+            num_channels=header["num_channels"],
+        )
+
+    def _open_binary_timetags(self, full_path, header, build_index=False):
+        channels, times = map_timetag_columns(full_path, header)
+        index = None
+        if header["n_tags"] > 0:
+            index = self._load_timetag_index(full_path, header, channels, times, build=build_index)
+        return TagDataset(
+            channels,
+            times,
+            bin_resolution_ns=header["bin_resolution_ns"],
+            duration_s=header["duration_s"] or None,
+            index=index,
+        )
+
+    @staticmethod
+    def _load_timetag_index(full_path, header, channels, times, build=False):
+        """
+        Returns the sidecar index of a binary time-tag file if it matches the file. Otherwise, with build=True, it
+        is (re)built and saved, unless it cannot be written; None if there is no usable index.
+        """
+        index_path = timetag_index_path(full_path)
+        fingerprint = None
+        if index_path.exists():
+            index = TimeTagIndex.load(index_path)
+            if index is not None and index.n_tags == header["n_tags"]:
+                fingerprint = _timetag_fingerprint(full_path, channels, times)
+                if index.fingerprint == fingerprint:
+                    return index
+        if not build:
+            return None
+        if fingerprint is None:
+            fingerprint = _timetag_fingerprint(full_path, channels, times)
+        try:
+            return TimeTagIndex.build(
+                index_path, channels, times, fingerprint, num_channels=header["num_channels"]
+            )
+        except OSError as error:
+            warnings.warn(f"Could not write the time-tag index {index_path} ({error}), scanning the file instead")
+            return None
+
+    @staticmethod
+    def _select_timetags(tags, channels=None, start=None, stop=None):
+        tag_channels, times = tag_columns(tags)
+        keep = np.ones(len(times), dtype=bool)
+        if channels is not None:
+            keep &= np.isin(tag_channels, channels)
+        if start is not None:
+            keep &= times >= start
+        if stop is not None:
+            keep &= times < stop
+        return tags[keep]
+
+    def save_timetags(
+        self, tags, filename, duration_s=0.0, num_channels=16, bin_resolution_ns=0.15625
+    ):
+        """
+        Saves TAG_DTYPE tags (sorted by time) to a binary time-tag file, see TimeTagWriter.
+        """
+        full_path = self.path.joinpath(filename)
+        with TimeTagWriter(
+            full_path,
+            num_channels=num_channels,
+            bin_resolution_ns=bin_resolution_ns,
+            duration_s=duration_s,
+        ) as writer:
+            writer.write(tags)
+        if self.verbose:
+            print(f"{current_time()} | Saved to {full_path} successfully.")
+
+    def timetag_file_path(self, filename, convert=True):
+        """Path of the tag file open_timetag_writer writes: {filename}.txt, or {filename}.ttbin with convert=False."""
+        return self.path.joinpath(f"{filename}.txt" if convert else f"{filename}.ttbin")
+
+    @contextlib.contextmanager
+    def open_timetag_writer(
+        self, filename, convert=True, duration_s=0.0, num_channels=16, bin_resolution_ns=0.15625
+    ):
+        """
+        Opens {filename}.txt (convert=True, tab-separated channel and time rows) or the binary {filename}.ttbin
+        (see TimeTagWriter) to write tags chunk by chunk, as the time taggers' save_tags and stream_tags do.
+        Yields (file_path, write), where write appends a chunk of time-sorted tags.
+        As with TimeTagWriter, the file only replaces an existing one once it is complete.
+        """
+        full_path = self.timetag_file_path(filename, convert)
+        if convert:
+            os.makedirs(full_path.parent, exist_ok=True)
+            part_path = _part_path(full_path)
+            try:
+                with open(part_path, "w") as f:
+                    f.write("Channel\tTime\n")
+
+                    def write_rows(tags):
+                        rows = np.column_stack(tag_columns(tags)).astype(np.int64)
+                        np.savetxt(f, rows, fmt="%d", delimiter="\t")
+
+                    yield full_path, write_rows
+            except BaseException:
+                os.remove(part_path)
+                raise
+            os.replace(part_path, full_path)
+        else:
+            with TimeTagWriter(
+                full_path,
+                num_channels=num_channels,
+                bin_resolution_ns=bin_resolution_ns,
+                duration_s=duration_s,
+            ) as writer:
+                yield full_path, writer.write
+
     def save_figure(self, fig, filename):
         full_path = self.path.joinpath(filename)
         os.makedirs(full_path.parent, exist_ok=True)
@@ -120,6 +925,22 @@ class IO:
         if self.verbose:
             print(f"{current_time()} | Saved figure to {full_path} successfully.")
 
+    def save_timetag_archive(self, tags, filename, duration_s=0.0, codec="zlib", **kwargs):
+        """
+        Saves time-sorted tags to a compressed archive for long-term storage, see save_timetag_archive.
+        """
+        full_path = self.path.joinpath(filename)
+        save_timetag_archive(full_path, tags, duration_s=duration_s, codec=codec, **kwargs)
+        if self.verbose:
+            print(f"{current_time()} | Saved to {full_path} successfully.")
+
+    def load_timetag_archive(self, filename, max_workers=None):
+        full_path = self.path.joinpath(filename)
+        tags = load_timetag_archive(full_path, max_workers=max_workers)
+        if self.verbose:
+            print(f"{current_time()} | Loaded from {full_path} successfully.")
+        return tags
+
     def save_np_array(self, variable, filename):
         full_path = self.path.joinpath(filename)
         os.makedirs(full_path.parent, exist_ok=True)
@@ -33,8 +33,15 @@ class PlotLogicGrid(QWidget):
     def update_grid(self):
         #duration_s = self.ui_config["INTEGRATION_TIME_MS"] / 1000.0
         #self.timetagger.read(duration_s)  # read the data from the time tagger once per loop
-        for i, plot in enumerate(self.plots):
-            plot.onNewData()
+        patterns = [plot.get_pattern() for plot in self.plots]
+        if hasattr(self.timetagger, "get_count_data_many"):
+            # one call, so every plot shows the same snapshot
+            _, counts, _ = self.timetagger.get_count_data_many(patterns)
+        else:
+            counts = [self.timetagger.get_count_data(channels)[1] for channels in patterns]
+
+        for plot, count in zip(self.plots, counts):
+            plot.onNewData(count)
 
 
 class PlotLogic(QWidget):
@@ -99,14 +106,18 @@ class PlotLogic(QWidget):
         layout.addLayout(plot_button_layout)
         self.setLayout(layout)
 
-    def onNewData(self):
+    def get_pattern(self):
         # create binary pattern for the logic pattern to plot
         channels = []
         for ch, btn in enumerate(self.logic_pattern_buttons, 1):
             if btn.curr_value == 1:
                 channels.append(ch)
+        return channels
 
-        dt, counts, rate = self.timetagger.get_count_data(channels)
+    def onNewData(self, counts=None):
+        # counts can be passed in when the grid has already read all patterns at once
+        if counts is None:
+            dt, counts, rate = self.timetagger.get_count_data(self.get_pattern())
 
         # update this value with the one from the logic pattern
         new_count_value = round(counts)